@@ -0,0 +1,175 @@
+"""Static performance analysis of generated apps against configurable budgets."""
+
+import logging
+import re
+
+from agent.config import BudgetConfig
+from agent.validator import HtmlValidator, Rule
+
+logger = logging.getLogger(__name__)
+
+_DATA_URI = re.compile(r"data:[\w.+/-]*;base64,[A-Za-z0-9+/=]+")
+_TIMER_CALLS = {
+    "setInterval": re.compile(r"\bsetInterval\s*\("),
+    "setTimeout": re.compile(r"\bsetTimeout\s*\("),
+    "requestAnimationFrame": re.compile(r"\brequestAnimationFrame\s*\("),
+}
+_INTERVAL_DELAY = re.compile(r",\s*(\d+)\s*$")
+_BUSY_INTERVAL_MS = 16  # setInterval delays below one frame
+_LOOP_START = re.compile(r"\b(?:for|while)\s*\(|\.forEach\s*\(")
+# Properties and calls that force a synchronous layout when read
+_LAYOUT_READ = re.compile(
+    r"\.(?:offset(?:Width|Height|Top|Left)|client(?:Width|Height|Top|Left)"
+    r"|scroll(?:Width|Height|Top|Left)|getBoundingClientRect\s*\(|getClientRects\s*\()"
+    r"|\bgetComputedStyle\s*\("
+)
+
+
+def _utf8_len(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+def _block_end(source: str, pos: int, open_ch: str, close_ch: str) -> int:
+    """Index just past the bracket matching the one at ``pos`` (or len(source))."""
+    depth = 0
+    for i in range(pos, len(source)):
+        ch = source[i]
+        if ch == open_ch:
+            depth += 1
+        elif ch == close_ch:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(source)
+
+
+def _busy_timers(js: str) -> int:
+    """Count setInterval calls with a literal delay shorter than a frame."""
+    count = 0
+    for match in _TIMER_CALLS["setInterval"].finditer(js):
+        end = _block_end(js, match.end() - 1, "(", ")")
+        delay = _INTERVAL_DELAY.search(js, match.end(), end - 1)
+        if delay and int(delay.group(1)) < _BUSY_INTERVAL_MS:
+            count += 1
+    return count
+
+
+def _layout_reads_in_loops(js: str) -> int:
+    """Count layout reads inside loop bodies (outermost loops only)."""
+    count = 0
+    pos = 0
+    while match := _LOOP_START.search(js, pos):
+        paren = match.end() - 1
+        end = _block_end(js, paren, "(", ")")
+        if not match.group().startswith(".forEach"):
+            brace = end
+            while brace < len(js) and js[brace].isspace():
+                brace += 1
+            if brace < len(js) and js[brace] == "{":
+                end = _block_end(js, brace, "{", "}")
+            else:
+                semicolon = js.find(";", brace)
+                end = len(js) if semicolon == -1 else semicolon + 1
+        count += len(_LAYOUT_READ.findall(js, match.end(), end))
+        pos = end
+    return count
+
+
+class PerfRule(Rule):
+    """Collect markup, style and script sizes plus DOM and inline-data counts."""
+
+    name = "perf"
+
+    def __init__(self):
+        self.dom_nodes = 0
+        self.style_bytes = 0
+        self.script_bytes = 0
+        self.inline_data_bytes = 0
+        self.scripts: list[str] = []
+        self._in = None
+
+    def start_tag(self, validator, tag, attrs):
+        self.dom_nodes += 1
+        if tag in ("script", "style"):
+            self._in = tag
+        for _, value in attrs:
+            if value and "base64," in value:
+                self.inline_data_bytes += sum(len(m) for m in _DATA_URI.findall(value))
+
+    def end_tag(self, validator, tag):
+        if tag == self._in:
+            self._in = None
+
+    def data(self, validator, text):
+        if self._in is None:
+            return
+        if "base64," in text:
+            self.inline_data_bytes += sum(len(m) for m in _DATA_URI.findall(text))
+        if self._in == "style":
+            self.style_bytes += _utf8_len(text)
+        else:
+            self.script_bytes += _utf8_len(text)
+            self.scripts.append(text)
+
+
+def analyze_html(html: str) -> dict:
+    """Measure the runtime weight of an app.
+
+    Returns byte counts for scripts, styles and the rest of the markup,
+    inline base64 data, the number of elements in the static DOM, timer and
+    requestAnimationFrame call sites, setInterval calls faster than a frame
+    and layout reads inside loops.
+    """
+    rule = PerfRule()
+    validator = HtmlValidator(rules=[rule])
+    validator.feed(html)
+    validator.close()
+
+    js = "\n".join(rule.scripts)
+    return {
+        "total_bytes": validator.bytes,
+        "script_bytes": rule.script_bytes,
+        "style_bytes": rule.style_bytes,
+        "markup_bytes": validator.bytes - rule.script_bytes - rule.style_bytes,
+        "inline_data_bytes": rule.inline_data_bytes,
+        "dom_nodes": rule.dom_nodes,
+        "timers": {name: len(pattern.findall(js)) for name, pattern in _TIMER_CALLS.items()},
+        "busy_timers": _busy_timers(js),
+        "layout_reads_in_loops": _layout_reads_in_loops(js),
+    }
+
+
+# Report key -> BudgetConfig field and a description for findings
+_BUDGETS = {
+    "total_bytes": ("max_total_bytes", "total size {value} bytes"),
+    "script_bytes": ("max_script_bytes", "inline scripts {value} bytes"),
+    "style_bytes": ("max_style_bytes", "inline styles {value} bytes"),
+    "inline_data_bytes": ("max_inline_data_bytes", "inline base64 data {value} bytes"),
+    "dom_nodes": ("max_dom_nodes", "{value} elements in the static DOM"),
+    "busy_timers": ("max_busy_timers",
+                    f"{{value}} setInterval call(s) faster than {_BUSY_INTERVAL_MS}ms"),
+    "layout_reads_in_loops": ("max_layout_reads_in_loops",
+                              "{value} layout read(s) inside loops"),
+}
+
+
+def check_budgets(report: dict, budget: BudgetConfig) -> list[str]:
+    """Return one finding per budget the report exceeds."""
+    findings = []
+    for key, (limit_name, description) in _BUDGETS.items():
+        limit = getattr(budget, limit_name)
+        value = report.get(key, 0)
+        if limit is not None and value > limit:
+            findings.append(f"Over budget: {description.format(value=value)} (limit {limit})")
+    return findings
+
+
+def budget_metrics(report: dict) -> dict:
+    """The budgeted figures of a report, e.g. for before/after comparisons."""
+    return {key: report.get(key, 0) for key in _BUDGETS}
+
+
+def is_lighter(before: dict, after: dict) -> bool:
+    """True if no budgeted figure grew and at least one shrank."""
+    old, new = budget_metrics(before), budget_metrics(after)
+    return all(new[k] <= old[k] for k in old) and any(new[k] < old[k] for k in old)
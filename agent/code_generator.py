@@ -2,34 +2,243 @@
 
 import logging
 import re
+import threading
 import time
 
-import requests
-
 from agent.config import AppConfig
+from agent.ollama_client import StreamMetrics, get_client, server_timings
+from agent.similarity import CHARS_PER_TOKEN
+from agent.validator import StreamGuard
 
 logger = logging.getLogger(__name__)
 
+# Ollama drops the matched stop sequence from the output; see close_document()
+HTML_STOP_SEQUENCES = ["</html>"]
+
+# Prompts start with the same static text so Ollama's prompt cache can reuse
+# the evaluated prefix across phases and across apps.
+PROMPT_PREAMBLE = """You are an expert web developer who builds self-contained single-page web applications.
+
+Every application must:
+- Be a single HTML file with ALL CSS and JS inline (no external files or CDNs)
+- Work completely offline
+- Be interactive and visually polished
+- Use a responsive design with a clean, modern UI"""
+
+PLAN_INSTRUCTIONS = """Plan the architecture for this application. Outline:
+1. Key UI components and layout
+2. Core JavaScript logic and state management
+3. CSS styling approach
+4. User interactions and animations
+
+Be specific and detailed. This plan will guide the code generation."""
+
+CODE_INSTRUCTIONS = """Generate the COMPLETE single-page web application.
+
+CRITICAL REQUIREMENTS:
+- Output a COMPLETE, valid HTML5 document
+- ALL CSS must be in a <style> tag inside <head>
+- ALL JavaScript must be in a <script> tag before </body>
+- NO external dependencies (no CDNs, no imports, no fetch to external URLs)
+- Must work completely offline when opened in a browser
+- Include a proper <title> tag
+- Make it visually appealing with modern CSS (gradients, shadows, animations)
+- Make it fully interactive and functional
+- Responsive design that works on mobile and desktop
+
+Output ONLY the complete HTML code inside a ```html code block. No explanations before or after."""
+
+
+OPTIMIZE_INSTRUCTIONS = """Rewrite the application to fix these issues. Keep every feature, the layout and the
+look exactly as they are; only change what is needed to make it lighter and faster.
+
+Output ONLY the complete HTML code inside a ```html code block. No explanations before or after."""
+
+
+def _app_block(idea: dict) -> str:
+    """Per-app details, placed after the static preamble."""
+    return f"""Title: {idea["title"]}
+Description: {idea["description"]}
+Category: {idea["category"]}"""
+
+
+CONTINUE_PROMPT = """Your previous reply was cut off. Continue the HTML document exactly where it stopped.
+Do not repeat anything that was already written and do not add any explanation."""
 
-def _query_ollama(config: AppConfig, prompt: str, temperature: float) -> str:
-    """Send a prompt to Ollama and return the response text."""
-    response = requests.post(
-        f"{config.ollama.url}/api/generate",
-        json={
-            "model": config.ollama.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "num_predict": 8192,
-            },
-        },
-        timeout=config.ollama.timeout,
+# Leading text allowed before the HTML document must have started
+PROSE_LIMIT = 400
+# Smallest generation budget worth a request; below it a truncated document is given up
+MIN_REQUEST_TOKENS = 256
+
+# Counters from Ollama responses that are summed across continuation requests
+_COUNTER_KEYS = ("total_duration", "load_duration", "prompt_eval_count",
+                 "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+def _query_ollama(config: AppConfig, prompt: str, temperature: float,
+                  stop: list[str] | None = None, num_predict: int | None = None,
+                  cancel: threading.Event | None = None, **extra) -> dict:
+    """Send a prompt to Ollama and return the full response.
+
+    ``extra`` is passed through as top-level request fields (e.g. ``context``).
+    """
+    options = {
+        "temperature": temperature,
+        "num_predict": num_predict or config.generation.num_predict,
+    }
+    if stop:
+        options["stop"] = stop
+    return get_client(config.ollama).generate(prompt, options=options, cancel=cancel, **extra)
+
+
+def _stream_ollama(config: AppConfig, prompt: str, temperature: float,
+                   extractor: "HtmlStreamExtractor", stop: list[str] | None = None,
+                   num_predict: int | None = None,
+                   cancel: threading.Event | None = None,
+                   fail_fast: "FailFast | None" = None,
+                   **extra) -> tuple[dict, StreamMetrics]:
+    """Stream a prompt to Ollama, feeding text to ``extractor`` as it arrives.
+
+    Generation ends on the server at a ``stop`` sequence, so the final chunk
+    with Ollama's counters still arrives. The connection is only closed early,
+    making Ollama abandon the rest of the generation, once ``cancel`` is set
+    or ``fail_fast`` has found a fatal problem.
+    """
+    def on_text(text: str) -> bool:
+        extractor.feed(text)
+        if cancel is not None and cancel.is_set():
+            return True
+        return fail_fast is not None and fail_fast.check(extractor)
+
+    options = {
+        "temperature": temperature,
+        "num_predict": num_predict or config.generation.num_predict,
+    }
+    if stop:
+        options["stop"] = stop
+    data, metrics = get_client(config.ollama).generate_stream(
+        prompt,
+        options=options,
+        on_text=on_text,
+        cancel=cancel,
+        **extra,
     )
-    if not response.ok:
-        error_body = response.text[:500]
-        raise RuntimeError(f"Ollama {response.status_code}: {error_body}")
-    return response.json()["response"]
+    logger.info("Streamed %d tokens (first token after %.1fs, %s tok/s)",
+                metrics.tokens, metrics.first_token_seconds or 0.0,
+                metrics.tokens_per_second or "?")
+    return data, metrics
+
+
+class HtmlStreamExtractor:
+    """Track where the HTML document starts and ends in a streamed response.
+
+    Only the newly arrived tail is scanned on each ``feed``, so the total
+    work is linear in the response length.
+    """
+
+    _OVERLAP = 16  # longest marker, so markers split across chunks are found
+
+    def __init__(self):
+        self.text = ""
+        self.start: int | None = None
+        self.in_fence = False
+        self.html_end: int | None = None
+        self.complete = False
+        self._scanned = 0
+        self._resume_buf: str | None = None
+
+    def resume(self) -> None:
+        """Expect a continuation response next.
+
+        Models often re-open the ```html fence when asked to continue; that
+        line is dropped so the continuation splices onto the existing text.
+        """
+        self._resume_buf = ""
+
+    def flush(self) -> None:
+        """Release any text held back while checking a continuation's first line."""
+        if self._resume_buf is not None:
+            pending, self._resume_buf = self._resume_buf, None
+            self.feed(pending)
+
+    def close_document(self) -> None:
+        """Append ``</html>`` after the model stopped on that stop sequence."""
+        self.flush()
+        if self.start is not None and self.html_end is None:
+            self.feed("</html>")
+
+    def feed(self, chunk: str) -> bool:
+        """Append a chunk; returns True once a complete document has been seen."""
+        if self._resume_buf is not None:
+            self._resume_buf += chunk
+            head = self._resume_buf.lstrip()
+            if "```".startswith(head) or (head.startswith("```") and "\n" not in head):
+                return self.complete  # can't tell yet whether this is a re-opened fence
+            chunk = head.split("\n", 1)[1] if head.startswith("```") else self._resume_buf
+            self._resume_buf = None
+        self.text += chunk
+        if self.complete:
+            return True
+        offset = max(0, self._scanned - self._OVERLAP)
+        window = self.text[offset:].lower()
+        self._scanned = len(self.text)
+
+        if self.start is None:
+            fence = re.search(r"```html?\s*\n", window)
+            doc = re.search(r"<!doctype|<html", window)
+            if fence and (not doc or fence.start() < doc.start()):
+                self.start = offset + fence.end()
+                self.in_fence = True
+            elif doc:
+                self.start = offset + doc.start()
+            else:
+                return False
+            offset = self.start
+            window = self.text[offset:].lower()
+
+        if self.html_end is None:
+            pos = window.find("</html>")
+            if pos == -1:
+                return False
+            self.html_end = offset + pos + len("</html>")
+
+        if not self.in_fence or "```" in self.text[self.html_end:]:
+            self.complete = True
+        return self.complete
+
+    def result(self) -> str:
+        """Return the extracted HTML for everything fed so far."""
+        return _extract_html(self.text)
+
+
+class FailFast:
+    """Validate the document part of a streamed response while it arrives.
+
+    Catches output that cannot pass validation, so the attempt can be
+    abandoned before the model has spent its whole token budget: leading
+    prose with no document in sight, and whatever StreamGuard rejects.
+    """
+
+    def __init__(self):
+        self.guard = StreamGuard()
+        self.error: str | None = None
+        self._fed: int | None = None
+
+    def check(self, extractor: HtmlStreamExtractor) -> bool:
+        """Feed the newly arrived part of the document; True once it has failed."""
+        if self.error:
+            return True
+        if extractor.start is None:
+            if len(extractor.text.lstrip()) > PROSE_LIMIT:
+                self.error = "Output starts with prose instead of HTML"
+            return self.error is not None
+        if self._fed is None:
+            self._fed = extractor.start
+        end = extractor.html_end if extractor.html_end is not None else len(extractor.text)
+        if end > self._fed:
+            self.error = self.guard.feed(extractor.text[self._fed:end])
+            self._fed = end
+        return self.error is not None
 
 
 def _extract_html(raw: str) -> str:
@@ -54,75 +263,162 @@ def _extract_html(raw: str) -> str:
     return "\n".join(lines[start:]).strip()
 
 
-def generate_code(config: AppConfig, idea: dict, temperature: float) -> tuple[str, dict]:
-    """Generate a complete SPA using two-phase prompting.
+def _sum_counters(responses: list[dict]) -> dict:
+    """Add up Ollama's timing counters over several responses."""
+    total: dict = {}
+    for data in responses:
+        for key in _COUNTER_KEYS:
+            if key in data:
+                total[key] = total.get(key, 0) + data[key]
+    return total
 
-    Phase 1: Architecture plan
-    Phase 2: Full HTML generation
 
-    Returns (html_string, benchmark_dict).
+def _context_room(config: AppConfig, prompt: str, context: list | None) -> int:
+    """Tokens the model can still generate after ``context`` and ``prompt``.
+
+    Past ``ollama.num_ctx`` Ollama shifts the oldest tokens out, which drops
+    the instructions and the start of the document.
     """
-    title = idea["title"]
-    description = idea["description"]
-    category = idea["category"]
+    return config.ollama.num_ctx - len(context or ()) - len(prompt) // CHARS_PER_TOKEN - 1
 
-    # Phase 1: Architecture plan
-    plan_prompt = f"""You are an expert web developer. Plan the architecture for this single-page web application:
 
-Title: {title}
-Description: {description}
-Category: {category}
+def _generate_document(config: AppConfig, prompt: str, temperature: float,
+                       cancel: threading.Event | None = None,
+                       **extra) -> tuple[str, list[dict], StreamMetrics | None]:
+    """Run the phase-2 request, continuing it while Ollama reports truncation.
 
-Requirements:
-- Single HTML file with ALL CSS and JS inline (no external files or CDNs)
-- Must work completely offline
-- Interactive and visually polished
-- Responsive design
-- Clean, modern UI
+    When a response ends with ``done_reason == "length"`` the next request
+    continues from that response's context and its text is appended, until
+    the document closes or ``generation.max_total_tokens`` is spent. Each
+    request is capped so its context plus output fits in ``ollama.num_ctx``.
 
-Outline:
-1. Key UI components and layout
-2. Core JavaScript logic and state management
-3. CSS styling approach
-4. User interactions and animations
+    Setting ``cancel`` abandons the request mid-generation; RuntimeError is
+    raised once it has been set. With ``generation.fail_fast`` the response
+    is streamed and validated as it arrives, and RuntimeError is raised as
+    soon as it can no longer pass.
 
-Be specific and detailed. This plan will guide the code generation."""
+    Returns (html, raw_responses, stream_metrics).
+    """
+    gen = config.generation
+    extractor = HtmlStreamExtractor()
+    streaming = gen.stream or gen.fail_fast
+    fail_fast = FailFast() if gen.fail_fast else None
+    stop = HTML_STOP_SEQUENCES if gen.early_stop else None
+    responses: list[dict] = []
+    stream_metrics = None
+    tokens_used = 0
+    num_predict = max(MIN_REQUEST_TOKENS,
+                      min(gen.num_predict, gen.max_total_tokens,
+                          _context_room(config, prompt, extra.get("context"))))
+
+    while True:
+        if streaming:
+            data, metrics = _stream_ollama(config, prompt, temperature, extractor, stop=stop,
+                                           num_predict=num_predict, cancel=cancel,
+                                           fail_fast=fail_fast, **extra)
+            if stream_metrics is None:
+                stream_metrics = metrics
+            else:
+                stream_metrics.extend(metrics)
+            tokens_used += metrics.tokens
+        else:
+            data = _query_ollama(config, prompt, temperature=temperature, stop=stop,
+                                 num_predict=num_predict, cancel=cancel, **extra)
+            extractor.feed(data["response"])
+            tokens_used += data.get("eval_count", num_predict)
+        extractor.flush()
+        responses.append(data)
+        if cancel is not None and cancel.is_set():
+            raise RuntimeError("Generation cancelled")
+        if fail_fast is not None and fail_fast.error:
+            logger.warning("Abandoned generation after %d tokens: %s",
+                           tokens_used, fail_fast.error)
+            raise RuntimeError(f"Generation aborted: {fail_fast.error}")
+
+        if data.get("done_reason") != "length" or extractor.complete:
+            break
+        context = data.get("context")
+        num_predict = min(gen.num_predict, gen.max_total_tokens - tokens_used,
+                          _context_room(config, CONTINUE_PROMPT, context)) if context else 0
+        if num_predict < MIN_REQUEST_TOKENS:
+            logger.warning("Output truncated after %d tokens; not continuing", tokens_used)
+            break
+        logger.info("Output truncated after %d tokens, requesting continuation", tokens_used)
+        prompt = CONTINUE_PROMPT
+        extra = {**extra, "context": context}
+        extractor.resume()
+
+    if stop and data.get("done_reason") == "stop":
+        extractor.close_document()
+    return extractor.result(), responses, stream_metrics
+
+
+def generate_plan(config: AppConfig, idea: dict, temperature: float) -> dict:
+    """Phase 1: ask for an architecture plan.
+
+    Returns a dict with the plan ``text``, the Ollama ``context`` to continue
+    from, the wall-clock ``seconds`` and the server ``timings``. The result
+    can be passed to several ``generate_code`` calls.
+    """
+    plan_prompt = f"""{PROMPT_PREAMBLE}
+
+{_app_block(idea)}
 
-    logger.info("Phase 1: Generating architecture plan for '%s'...", title)
+{PLAN_INSTRUCTIONS}"""
+
+    logger.info("Phase 1: Generating architecture plan for '%s'...", idea["title"])
     t0 = time.monotonic()
-    plan = _query_ollama(config, plan_prompt, temperature=temperature)
-    phase1_duration = time.monotonic() - t0
-    logger.debug("Architecture plan:\n%s", plan[:500])
+    data = _query_ollama(config, plan_prompt, temperature=temperature)
+    plan = {
+        "text": data["response"],
+        "context": data.get("context"),
+        "seconds": time.monotonic() - t0,
+        "timings": server_timings(data),
+    }
+    logger.debug("Architecture plan:\n%s", plan["text"][:500])
+    return plan
 
-    # Phase 2: Full code generation
-    code_prompt = f"""You are an expert web developer. Generate a COMPLETE single-page web application.
 
-Title: {title}
-Description: {description}
-Category: {category}
+def generate_code(config: AppConfig, idea: dict, temperature: float,
+                  plan: dict | None = None,
+                  cancel: threading.Event | None = None) -> tuple[str, dict]:
+    """Generate a complete SPA using two-phase prompting.
 
-Architecture Plan:
-{plan}
+    Phase 1: Architecture plan (skipped when ``plan`` from generate_plan is given)
+    Phase 2: Full HTML generation (abandoned when ``cancel`` is set)
 
-CRITICAL REQUIREMENTS:
-- Output a COMPLETE, valid HTML5 document
-- ALL CSS must be in a <style> tag inside <head>
-- ALL JavaScript must be in a <script> tag before </body>
-- NO external dependencies (no CDNs, no imports, no fetch to external URLs)
-- Must work completely offline when opened in a browser
-- Include a proper <title> tag
-- Make it visually appealing with modern CSS (gradients, shadows, animations)
-- Make it fully interactive and functional
-- Responsive design that works on mobile and desktop
+    Returns (html_string, benchmark_dict).
+    """
+    title = idea["title"]
 
-Output ONLY the complete HTML code inside a ```html code block. No explanations before or after."""
+    if plan is None:
+        plan = generate_plan(config, idea, temperature)
+    phase1_duration = plan["seconds"]
+
+    # Phase 2: Full code generation. Continuing from phase 1's context skips
+    # re-evaluating the preamble, app details and plan on the server.
+    context = plan["context"] if config.generation.reuse_context else None
+    if context:
+        code_prompt = f"""Now implement the application following the plan above.
+
+{CODE_INSTRUCTIONS}"""
+    else:
+        code_prompt = f"""{PROMPT_PREAMBLE}
+
+{_app_block(idea)}
+
+Architecture Plan:
+{plan["text"]}
+
+{CODE_INSTRUCTIONS}"""
+    extra = {"context": context} if context else {}
 
     logger.info("Phase 2: Generating full code for '%s'...", title)
     t1 = time.monotonic()
-    raw = _query_ollama(config, code_prompt, temperature=temperature)
+    html, responses, stream_metrics = _generate_document(config, code_prompt, temperature,
+                                                         cancel=cancel, **extra)
     phase2_duration = time.monotonic() - t1
 
-    html = _extract_html(raw)
     total_duration = phase1_duration + phase2_duration
     logger.info("Generated %d bytes of HTML in %.1fs (plan: %.1fs, code: %.1fs)",
                 len(html), total_duration, phase1_duration, phase2_duration)
@@ -134,4 +430,51 @@ Output ONLY the complete HTML code inside a ```html code block. No explanations
         "output_bytes": len(html),
         "temperature": temperature,
     }
+    if stream_metrics is not None:
+        benchmark.update(stream_metrics.as_benchmark("phase2"))
+    benchmark["phase1"] = plan["timings"]
+    benchmark["phase2"] = server_timings(_sum_counters(responses))
+    if len(responses) > 1:
+        benchmark["continuations"] = len(responses) - 1
     return html, benchmark
+
+
+def _optimize_prompt(idea: dict, html: str, findings: list[str]) -> str:
+    finding_list = "\n".join(f"- {f}" for f in findings)
+    return f"""{PROMPT_PREAMBLE}
+
+{_app_block(idea)}
+
+This working application exceeds its performance budget:
+{finding_list}
+
+```html
+{html}
+```
+
+{OPTIMIZE_INSTRUCTIONS}"""
+
+
+def can_optimize(config: AppConfig, idea: dict, html: str, findings: list[str]) -> bool:
+    """True if the optimization prompt and a full rewrite of ``html`` fit in ``ollama.num_ctx``."""
+    room = _context_room(config, _optimize_prompt(idea, html, findings), None)
+    return room >= len(html) // CHARS_PER_TOKEN
+
+
+def optimize_code(config: AppConfig, idea: dict, html: str,
+                  findings: list[str]) -> tuple[str, dict]:
+    """Ask the model for a lighter version of a working app.
+
+    ``findings`` are the performance-budget problems to fix. The returned
+    HTML has not been validated; check can_optimize() first, as the whole
+    document is sent and rewritten. Returns (html, benchmark_dict).
+    """
+    prompt = _optimize_prompt(idea, html, findings)
+
+    logger.info("Optimizing '%s' (%d findings)...", idea["title"], len(findings))
+    t0 = time.monotonic()
+    optimized, responses, _ = _generate_document(config, prompt, config.generation.temperature)
+    return optimized, {
+        "seconds": round(time.monotonic() - t0, 1),
+        "timings": server_timings(_sum_counters(responses)),
+    }
@@ -11,7 +11,12 @@ import yaml
 class OllamaConfig:
     url: str = "http://host.docker.internal:11434"
     model: str = "qwen3-coder:14b-16k"
+    num_ctx: int = 16384
     timeout: int = 300
+    connect_timeout: float = 10.0
+    idle_timeout: float = 60.0
+    max_retries: int = 2
+    pool_size: int = 4
 
 
 @dataclass
@@ -33,6 +38,50 @@ class GenerationConfig:
     max_retries: int = 3
     temperature: float = 0.7
     temperature_increment: float = 0.1
+    stream: bool = False
+    early_stop: bool = True
+    fail_fast: bool = True
+    reuse_context: bool = True
+    num_predict: int = 8192
+    max_total_tokens: int = 12288
+    plan_regen_after: int = 2
+    local_repair: bool = True
+    llm_repair: bool = True
+    repair_model: str = ""
+    repair_fragment_chars: int = 3000
+    parallel_candidates: int = 1
+    idea_batch_size: int = 30
+    dedup_context_k: int = 40
+    dedup_context_tokens: int = 600
+
+
+@dataclass
+class DedupConfig:
+    threshold: float = 0.35
+    num_perm: int = 96
+    bands: int = 32
+    semantic: bool = False
+    embedding_model: str = "nomic-embed-text"
+    semantic_threshold: float = 0.9
+
+
+@dataclass
+class BudgetConfig:
+    enforce: bool = False
+    optimize: bool = False
+    max_total_bytes: int = 300_000
+    max_script_bytes: int = 150_000
+    max_style_bytes: int = 60_000
+    max_inline_data_bytes: int = 50_000
+    max_dom_nodes: int = 1500
+    max_busy_timers: int = 0
+    max_layout_reads_in_loops: int = 0
+
+
+@dataclass
+class PublishConfig:
+    minify: bool = True
+    precompress: bool = True
 
 
 @dataclass
@@ -41,6 +90,9 @@ class AppConfig:
     schedule: ScheduleConfig = field(default_factory=ScheduleConfig)
     git: GitConfig = field(default_factory=GitConfig)
     generation: GenerationConfig = field(default_factory=GenerationConfig)
+    dedup: DedupConfig = field(default_factory=DedupConfig)
+    budget: BudgetConfig = field(default_factory=BudgetConfig)
+    publish: PublishConfig = field(default_factory=PublishConfig)
     categories: list[str] = field(default_factory=lambda: [
         "game", "tool", "visualization", "animation", "productivity",
         "educational", "creative", "music", "simulation", "puzzle",
@@ -76,6 +128,21 @@ def load_config(config_path: str = "config/config.yaml") -> AppConfig:
                 if hasattr(config.generation, k):
                     setattr(config.generation, k, v)
 
+        if "dedup" in data:
+            for k, v in data["dedup"].items():
+                if hasattr(config.dedup, k):
+                    setattr(config.dedup, k, v)
+
+        if "budget" in data:
+            for k, v in data["budget"].items():
+                if hasattr(config.budget, k):
+                    setattr(config.budget, k, v)
+
+        if "publish" in data:
+            for k, v in data["publish"].items():
+                if hasattr(config.publish, k):
+                    setattr(config.publish, k, v)
+
         if "categories" in data:
             config.categories = data["categories"]
 
@@ -0,0 +1,194 @@
+"""Optional semantic near-duplicate check using Ollama embeddings.
+
+Vectors are stored as raw float32 rows in ``embeddings.f32`` with their
+norms in ``embeddings.norms.f32`` and the slugs, one per line, in
+``embeddings.jsonl``. Adding an app appends to all three, and loading
+memory-maps the arrays, so startup cost does not grow with the corpus.
+The loaded index is kept for the life of the process and reloaded only
+when the slugs file changes underneath it. Requires numpy; without it the
+check is skipped.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from agent.config import AppConfig
+from agent.ollama_client import get_client
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "embeddings.f32"
+NORMS_FILE = "embeddings.norms.f32"
+SLUGS_FILE = "embeddings.jsonl"
+EMBED_BATCH = 64  # texts per /api/embed request when backfilling existing apps
+
+
+def _idea_text(idea: dict) -> str:
+    return f"{idea.get('title', '')}. {idea.get('description', '')}"
+
+
+class EmbeddingIndex:
+    """Append-only store of app embeddings with a vectorized cosine search."""
+
+    def __init__(self, repo_path: str):
+        self.root = Path(repo_path)
+        self.slugs: list[str] = []
+        self.titles: list[str] = []
+        self._vectors = None
+        self._norms = None
+        self._load()
+
+    def _load(self) -> None:
+        slugs_path = self.root / SLUGS_FILE
+        if slugs_path.exists():
+            with open(slugs_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.slugs.append(entry["slug"])
+                    self.titles.append(entry["title"])
+        self._map()
+        self.stamp = self._slugs_stamp()
+
+    def _slugs_stamp(self) -> tuple[int, int] | None:
+        """(mtime, size) of the slugs file, to notice writes by someone else."""
+        try:
+            st = (self.root / SLUGS_FILE).stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _map(self) -> None:
+        """Memory-map the vector and norm files for the current row count."""
+        count = len(self.slugs)
+        vectors_path = self.root / VECTORS_FILE
+        if not count or not vectors_path.exists():
+            return
+        norms = np.memmap(self.root / NORMS_FILE, dtype=np.float32, mode="r")
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r")
+        if len(norms) < count or len(vectors) % count:
+            raise ValueError("Embedding store is inconsistent; delete it to rebuild")
+        self._norms = norms[:count]
+        self._vectors = vectors.reshape(count, -1)
+
+    def __len__(self) -> int:
+        return len(self.slugs)
+
+    def add(self, entries: list[tuple[str, str, list[float]]]) -> None:
+        """Append (slug, title, vector) rows to the store."""
+        if not entries:
+            return
+        vectors = np.asarray([vector for _, _, vector in entries], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        with open(self.root / VECTORS_FILE, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.root / NORMS_FILE, "ab") as f:
+            f.write(norms.tobytes())
+        with open(self.root / SLUGS_FILE, "a") as f:
+            for slug, title, _ in entries:
+                f.write(json.dumps({"slug": slug, "title": title}) + "\n")
+                self.slugs.append(slug)
+                self.titles.append(title)
+        self._map()
+        self.stamp = self._slugs_stamp()
+
+    def nearest(self, vector, k: int = 5) -> list[tuple[str, str, float]]:
+        """Return the ``k`` most similar apps as (slug, title, cosine)."""
+        if self._vectors is None or not len(self.slugs):
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query)) or 1.0
+        scores = (self._vectors @ query) / (np.maximum(self._norms, 1e-12) * query_norm)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.slugs[i], self.titles[i], round(float(scores[i]), 3)) for i in top]
+
+
+_indexes: dict[str, EmbeddingIndex] = {}
+
+
+def _open_index(repo_path: str) -> EmbeddingIndex:
+    """Return the process-wide index for ``repo_path``, loading it when needed."""
+    index = _indexes.get(repo_path)
+    if index is None or index.stamp != index._slugs_stamp():
+        index = EmbeddingIndex(repo_path)
+        _indexes[repo_path] = index
+    return index
+
+
+def _enabled(config: AppConfig) -> bool:
+    if not config.dedup.semantic:
+        return False
+    if np is None:
+        logger.warning("dedup.semantic is enabled but numpy is not installed; skipping")
+        return False
+    return True
+
+
+def _backfill(config: AppConfig, index: EmbeddingIndex, apps: list[dict]) -> None:
+    """Embed apps that are not in the store yet, EMBED_BATCH per request.
+
+    Each batch is stored as soon as it is embedded, so an interrupted
+    backfill resumes where it stopped.
+    """
+    known = set(index.slugs)
+    missing = [app for app in apps if app["slug"] not in known]
+    if not missing:
+        return
+    logger.info("Embedding %d existing apps for semantic dedup", len(missing))
+    client = get_client(config.ollama)
+    for i in range(0, len(missing), EMBED_BATCH):
+        batch = missing[i:i + EMBED_BATCH]
+        vectors = client.embed([_idea_text(a) for a in batch], config.dedup.embedding_model)
+        index.add([(app["slug"], app["title"], vector) for app, vector in zip(batch, vectors)])
+
+
+def check_semantic_duplicate(config: AppConfig, idea: dict, apps: list[dict]) -> str | None:
+    """Embed ``idea`` and compare it with every existing app.
+
+    The idea's vector is kept on ``idea["embedding"]`` so record_embedding()
+    does not have to compute it again. Returns a description of the closest
+    app when its cosine similarity reaches ``dedup.semantic_threshold``, and
+    None when the embedding model or the stored vectors are unavailable.
+    """
+    if not _enabled(config):
+        return None
+    try:
+        index = _open_index(config.git.repo_path)
+        try:
+            _backfill(config, index, apps)
+        except Exception as e:
+            logger.warning("Embedding backfill incomplete (%d of %d apps stored): %s",
+                           len(index), len(apps), e)
+        vector = get_client(config.ollama).embed([_idea_text(idea)],
+                                                 config.dedup.embedding_model)[0]
+    except Exception as e:
+        # Like a missing numpy, an unusable backend skips the check
+        logger.warning("Semantic duplicate check skipped: %s", e)
+        return None
+    idea["embedding"] = vector
+    matches = index.nearest(vector, k=1)
+    if matches and matches[0][2] >= config.dedup.semantic_threshold:
+        _, title, score = matches[0]
+        return f"'{title}' (cosine {score})"
+    return None
+
+
+def record_embedding(config: AppConfig, idea: dict) -> None:
+    """Store a committed app's embedding, computing it if the check did not."""
+    if not _enabled(config):
+        return
+    vector = idea.get("embedding")
+    try:
+        if vector is None:
+            vector = get_client(config.ollama).embed([_idea_text(idea)],
+                                                     config.dedup.embedding_model)[0]
+        _open_index(config.git.repo_path).add([(idea["slug"], idea["title"], vector)])
+    except Exception as e:
+        logger.warning("Failed to store embedding for '%s': %s", idea["title"], e)
@@ -8,6 +8,10 @@ from agent.config import GitConfig
 
 logger = logging.getLogger(__name__)
 
+# Agent state kept in the repo root that must never be published: the app
+# store, the idea backlog, the near-duplicate index and the embeddings
+STATE_IGNORES = ["/apps.db*", "/idea_backlog.*", "/dedup_index.*", "/embeddings.*"]
+
 
 def _run_git(args: list[str], cwd: str) -> subprocess.CompletedProcess:
     """Run a git command and return the result."""
@@ -36,6 +40,21 @@ def init_repo(config: GitConfig) -> None:
         logger.info("Initialized git repo at %s", config.repo_path)
     else:
         logger.debug("Git repo already exists at %s", config.repo_path)
+    _ignore_state_files(repo)
+
+
+def _ignore_state_files(repo: Path) -> None:
+    """Add any missing STATE_IGNORES patterns to the repo's .gitignore."""
+    gitignore = repo / ".gitignore"
+    text = gitignore.read_text() if gitignore.exists() else ""
+    missing = [p for p in STATE_IGNORES if p not in text.splitlines()]
+    if not missing:
+        return
+    with open(gitignore, "a") as f:
+        if text and not text.endswith("\n"):
+            f.write("\n")
+        f.write("".join(p + "\n" for p in missing))
+    logger.info("Added agent state files to %s", gitignore)
 
 
 def commit_app(config: GitConfig, app_dir_name: str, app_title: str) -> bool:
@@ -43,7 +62,8 @@ def commit_app(config: GitConfig, app_dir_name: str, app_title: str) -> bool:
     repo = config.repo_path
 
     # Stage the app directory and index
-    result = _run_git(["add", app_dir_name, "index.html", "benchmark.html"], cwd=repo)
+    result = _run_git(["add", app_dir_name, "index.html", "benchmark.html", ".gitignore"],
+                      cwd=repo)
     if result.returncode != 0:
         logger.error("git add failed: %s", result.stderr)
         return False
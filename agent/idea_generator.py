@@ -1,95 +1,337 @@
-"""LLM-based SPA idea generation with deduplication."""
+"""LLM-based SPA idea generation with deduplication and a persistent backlog."""
 
 import json
 import logging
 import random
+import re
 from pathlib import Path
 
-import requests
-
 from agent.config import AppConfig
+from agent.ollama_client import get_client, server_timings
+from agent.similarity import MinHashIndex, TitleIndex, fit_budget
+from agent.store import open_store
 
 logger = logging.getLogger(__name__)
 
+# JSON schema passed as Ollama's ``format`` so the model can only emit an idea object
+IDEA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "category": {"type": "string"},
+        "slug": {"type": "string"},
+    },
+    "required": ["title", "description", "category", "slug"],
+}
+
+IDEA_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ideas": {"type": "array", "items": IDEA_SCHEMA},
+    },
+    "required": ["ideas"],
+}
+
+IDEA_FIELDS = ("title", "description", "category", "slug")
+
+IDEA_REQUIREMENTS = """Requirements:
+- Must be a self-contained single HTML file with inline CSS and JS
+- No external dependencies (no CDNs, no frameworks)
+- Should be interactive and visually appealing
+- Must work offline in a browser"""
+
+BACKLOG_FILE = "idea_backlog.jsonl"
+DEDUP_INDEX_FILE = "dedup_index.jsonl"
+TOKENS_PER_BATCH_IDEA = 80  # generous num_predict budget per idea in a batch
+
+
+def _complete_json(raw: str) -> str:
+    """Close an unterminated string and any open brackets in truncated JSON."""
+    closers = []
+    in_string = False
+    escaped = False
+    for ch in raw:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+    if in_string:
+        raw += '"'
+    # Drop a dangling key (with or without its colon), then a trailing comma
+    raw = re.sub(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', r"\1", raw.rstrip())
+    raw = re.sub(r"[,:]\s*$", "", raw)
+    return raw + "".join(reversed(closers))
+
+
+def _parse_json_object(raw: str) -> dict:
+    """Parse a JSON object from model output, tolerating fences and truncation."""
+    raw = raw.strip()
+    # Handle markdown code blocks
+    if "```" in raw:
+        raw = raw.split("```")[1]
+        if raw.startswith("json"):
+            raw = raw[4:]
+        raw = raw.strip()
+    start = raw.find("{")
+    if start == -1:
+        raise ValueError(f"No JSON object in response: {raw[:200]!r}")
+    raw = raw[start:]
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return json.loads(_complete_json(raw))
+
+
+def _slugify(text: str) -> str:
+    slug = text.lower().replace(" ", "-")
+    return "".join(c for c in slug if c.isalnum() or c == "-")
 
-def _get_existing_titles(repo_path: str) -> set[str]:
-    """Get titles of all existing apps for dedup."""
-    titles = set()
-    repo = Path(repo_path)
-    for metadata_file in repo.glob("*/metadata.json"):
-        try:
-            with open(metadata_file) as f:
-                data = json.load(f)
-            titles.add(data.get("title", "").lower())
-        except (json.JSONDecodeError, OSError):
-            continue
-    return titles
+
+def _validate_idea(idea: dict, category: str) -> dict:
+    """Check an idea's fields and fill the ones that can be derived.
+
+    A truncated response may lose its trailing fields; the category falls
+    back to the requested one and the slug is derived from the title.
+    """
+    if not isinstance(idea, dict):
+        raise ValueError(f"Idea is not an object: {idea!r}")
+    for field in ("title", "description"):
+        if not isinstance(idea.get(field), str) or not idea[field].strip():
+            raise ValueError(f"Missing field in idea: {field}")
+    if not isinstance(idea.get("category"), str) or not idea["category"].strip():
+        idea["category"] = category
+    if not isinstance(idea.get("slug"), str) or not _slugify(idea["slug"]).strip("-"):
+        idea["slug"] = idea["title"]
+    idea["slug"] = _slugify(idea["slug"])
+    return {field: idea[field].strip() for field in IDEA_FIELDS}
+
+
+def existing_apps(repo_path: str) -> list[dict]:
+    """Get slug, title, description, category and date of all existing apps, newest first."""
+    with open_store(repo_path) as store:
+        return store.dedup_apps()
+
+
+def _load_dedup_index(config: AppConfig, apps: list[dict]) -> MinHashIndex:
+    """Load the near-duplicate index, rebuilding it if apps are missing from it."""
+    index = MinHashIndex.load(Path(config.git.repo_path) / DEDUP_INDEX_FILE,
+                              config.dedup.num_perm, config.dedup.bands)
+    if any(app["slug"] not in index.entries for app in apps):
+        index.rebuild({app["slug"]: app for app in apps})
+    return index
+
+
+def _near_duplicate(config: AppConfig, index: MinHashIndex, idea: dict) -> str | None:
+    """Return a description of the closest near-duplicate, or None."""
+    matches = index.similar(idea, config.dedup.threshold)
+    if not matches:
+        return None
+    _, title, score = matches[0]
+    return f"'{title}' (similarity {score})"
+
+
+def record_app(config: AppConfig, idea: dict) -> None:
+    """Add a committed app to the near-duplicate index."""
+    path = Path(config.git.repo_path) / DEDUP_INDEX_FILE
+    MinHashIndex.load(path, config.dedup.num_perm, config.dedup.bands).add(idea["slug"], idea)
+
+
+def _dedup_context(config: AppConfig, apps: list[dict], categories: list[str]) -> str:
+    """List existing titles from ``categories`` within a token budget.
+
+    The prompt only needs the titles the model is likely to collide with, so
+    its size stays flat however many apps exist; exact duplicates are still
+    rejected after generation. Half of each category's share is its newest
+    titles, the rest a random sample of the older ones, so the list covers
+    the category over successive cycles instead of repeating itself.
+    """
+    if not apps:
+        return "none yet"
+    index = TitleIndex(apps)
+    per_category = max(1, config.generation.dedup_context_k // len(categories))
+    newest = (per_category + 1) // 2
+    titles: list[str] = []
+    for category in categories:
+        ranked = index.nearest(category, category=category)
+        older = ranked[newest:]
+        picked = ranked[:newest] + random.sample(older, min(len(older), per_category - newest))
+        for title in picked:
+            if title not in titles:
+                titles.append(title)
+    titles = fit_budget(titles, config.generation.dedup_context_tokens)
+    return ", ".join(titles) if titles else "none yet"
 
 
 def generate_idea(config: AppConfig) -> dict:
     """Generate a unique SPA idea using Ollama.
 
-    Returns dict with keys: title, description, category, slug
+    Returns dict with keys: title, description, category, slug, timings
     """
-    existing = _get_existing_titles(config.git.repo_path)
+    apps = existing_apps(config.git.repo_path)
+    existing = {app["title"].lower() for app in apps}
     category = random.choice(config.categories)
 
-    existing_list = ", ".join(sorted(existing)) if existing else "none yet"
+    existing_list = _dedup_context(config, apps, [category])
 
     prompt = f"""Generate a unique single-page web application idea.
 
 Category: {category}
 
-Requirements:
-- Must be a self-contained single HTML file with inline CSS and JS
-- No external dependencies (no CDNs, no frameworks)
-- Should be interactive and visually appealing
-- Must work offline in a browser
+{IDEA_REQUIREMENTS}
 
 Existing apps (avoid duplicates): {existing_list}
 
 Respond with ONLY valid JSON, no other text:
 {{"title": "App Title", "description": "One sentence description", "category": "{category}", "slug": "app-title-slug"}}"""
 
-    response = requests.post(
-        f"{config.ollama.url}/api/generate",
-        json={
-            "model": config.ollama.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.9,
-                "num_predict": 256,
-            },
+    data = get_client(config.ollama).generate(
+        prompt,
+        options={
+            "temperature": 0.9,
+            "num_predict": 256,
         },
-        timeout=config.ollama.timeout,
+        format=IDEA_SCHEMA,
     )
-    response.raise_for_status()
 
-    raw = response.json()["response"].strip()
+    raw = data["response"]
     logger.debug("Raw idea response: %s", raw)
-
-    # Extract JSON from response (handle markdown code blocks)
-    if "```" in raw:
-        raw = raw.split("```")[1]
-        if raw.startswith("json"):
-            raw = raw[4:]
-        raw = raw.strip()
-
-    idea = json.loads(raw)
-
-    # Validate required fields
-    for field in ("title", "description", "category", "slug"):
-        if field not in idea:
-            raise ValueError(f"Missing field in idea: {field}")
+    idea = _validate_idea(_parse_json_object(raw), category)
 
     # Dedup check
     if idea["title"].lower() in existing:
         raise ValueError(f"Duplicate idea: {idea['title']}")
+    duplicate_of = _near_duplicate(config, _load_dedup_index(config, apps), idea)
+    if duplicate_of:
+        raise ValueError(f"Near-duplicate idea: {idea['title']} ~ {duplicate_of}")
 
-    # Sanitize slug
-    idea["slug"] = idea["slug"].lower().replace(" ", "-")
-    idea["slug"] = "".join(c for c in idea["slug"] if c.isalnum() or c == "-")
+    idea["timings"] = server_timings(data)
 
     logger.info("Generated idea: %s (%s)", idea["title"], idea["category"])
     return idea
+
+
+def generate_idea_batch(config: AppConfig, count: int) -> tuple[list[dict], dict]:
+    """Generate up to ``count`` unique ideas across all categories in one call.
+
+    Ideas whose title matches an existing app or an earlier idea in the batch
+    are dropped, as are malformed entries (e.g. the last one in a truncated
+    response). Returns (ideas, server_timings).
+    """
+    apps = existing_apps(config.git.repo_path)
+    seen = {app["title"].lower() for app in apps}
+    existing_list = _dedup_context(config, apps, config.categories)
+    categories = ", ".join(config.categories)
+
+    prompt = f"""Generate {count} unique single-page web application ideas.
+
+Spread them evenly across these categories: {categories}
+
+{IDEA_REQUIREMENTS}
+
+Existing apps (avoid duplicates): {existing_list}
+
+Respond with ONLY valid JSON, no other text:
+{{"ideas": [{{"title": "App Title", "description": "One sentence description", "category": "one of the categories", "slug": "app-title-slug"}}]}}"""
+
+    data = get_client(config.ollama).generate(
+        prompt,
+        options={
+            "temperature": 0.9,
+            "num_predict": count * TOKENS_PER_BATCH_IDEA,
+        },
+        format=IDEA_BATCH_SCHEMA,
+    )
+    logger.debug("Raw idea batch response: %s", data["response"])
+    parsed = _parse_json_object(data["response"])
+
+    # Accepted ideas join the in-memory index so near-duplicates within
+    # the batch are caught too
+    index = _load_dedup_index(config, apps)
+    ideas = []
+    for entry in parsed.get("ideas", []):
+        try:
+            idea = _validate_idea(entry, random.choice(config.categories))
+        except ValueError as e:
+            logger.debug("Skipping idea from batch: %s", e)
+            continue
+        if idea["title"].lower() in seen:
+            continue
+        duplicate_of = _near_duplicate(config, index, idea)
+        if duplicate_of:
+            logger.info("Skipping near-duplicate idea %s ~ %s", idea["title"], duplicate_of)
+            continue
+        seen.add(idea["title"].lower())
+        index.add(f"backlog:{idea['slug']}", idea, persist=False)
+        ideas.append(idea)
+
+    logger.info("Generated %d unique ideas in one batch", len(ideas))
+    return ideas, server_timings(data)
+
+
+def _load_backlog(path: Path) -> list[dict]:
+    """Read queued ideas, skipping unreadable lines."""
+    if not path.exists():
+        return []
+    ideas = []
+    with open(path) as f:
+        for line in f:
+            try:
+                ideas.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return ideas
+
+
+def _save_backlog(path: Path, ideas: list[dict]) -> None:
+    """Rewrite the backlog atomically so a crash never leaves it half-written."""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        for idea in ideas:
+            f.write(json.dumps(idea) + "\n")
+    tmp.replace(path)
+
+
+def next_idea(config: AppConfig) -> dict:
+    """Take the next idea from the backlog, refilling it with one batch call when empty.
+
+    With ``generation.idea_batch_size`` set to 0 this falls back to one
+    generate_idea call per cycle. Queued ideas that have since become
+    duplicates or near-duplicates of committed apps are discarded.
+
+    Returns dict with keys: title, description, category, slug, timings
+    """
+    batch_size = config.generation.idea_batch_size
+    if batch_size <= 0:
+        return generate_idea(config)
+
+    path = Path(config.git.repo_path) / BACKLOG_FILE
+    apps = existing_apps(config.git.repo_path)
+    existing = {app["title"].lower() for app in apps}
+    index = _load_dedup_index(config, apps)
+    backlog = [i for i in _load_backlog(path)
+               if i["title"].lower() not in existing and not _near_duplicate(config, index, i)]
+
+    timings = {}
+    if not backlog:
+        logger.info("Idea backlog empty, requesting %d ideas", batch_size)
+        backlog, timings = generate_idea_batch(config, batch_size)
+        if not backlog:
+            raise ValueError("Idea batch produced no usable ideas")
+        timings["batch_size"] = len(backlog)
+
+    idea = backlog.pop(0)
+    _save_backlog(path, backlog)
+    idea["timings"] = timings
+    logger.info("Next idea: %s (%s), %d left in backlog",
+                idea["title"], idea["category"], len(backlog))
+    return idea
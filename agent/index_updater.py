@@ -1,57 +1,79 @@
-"""Gallery index page generator using Jinja2."""
+"""Gallery index page generator using Jinja2.
 
-import json
+Each app's gallery card and benchmark row are rendered once and cached in
+the app store; a rebuild only renders apps that are new, changed or named
+by the caller, then assembles the pages from the cached fragments. Pages
+whose content did not change are not rewritten.
+"""
+
+import hashlib
 import logging
 from pathlib import Path
 
 from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup
 
-logger = logging.getLogger(__name__)
-
-
-def scan_apps(repo_path: str) -> list[dict]:
-    """Scan app directories for metadata.json files."""
-    apps = []
-    repo = Path(repo_path)
-
-    for metadata_file in sorted(repo.glob("*/metadata.json")):
-        try:
-            with open(metadata_file) as f:
-                metadata = json.load(f)
-            metadata["dir_name"] = metadata_file.parent.name
-            apps.append(metadata)
-        except (json.JSONDecodeError, OSError) as e:
-            logger.warning("Failed to read %s: %s", metadata_file, e)
-
-    # Sort by date descending (newest first)
-    apps.sort(key=lambda a: a.get("date", ""), reverse=True)
-    logger.info("Found %d apps", len(apps))
-    return apps
+from agent.store import AppStore, open_store
 
+logger = logging.getLogger(__name__)
 
-def update_index(repo_path: str, template_dir: str = "templates") -> None:
-    """Regenerate the gallery index.html and benchmark.html from all app metadata."""
-    apps = scan_apps(repo_path)
+FRAGMENT_TEMPLATES = ("gallery_card.html", "benchmark_row.html")
 
-    env = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
 
-    # Gallery page
-    gallery_template = env.get_template("gallery_template.html")
-    categories = sorted({app.get("category", "other") for app in apps})
-    gallery_html = gallery_template.render(apps=apps, categories=categories)
+def _template_sha(env: Environment) -> str:
+    """Hash of the fragment templates, so editing them invalidates the cache."""
+    digest = hashlib.sha256()
+    for name in FRAGMENT_TEMPLATES:
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
 
-    index_path = Path(repo_path) / "index.html"
-    with open(index_path, "w") as f:
-        f.write(gallery_html)
 
-    logger.info("Updated gallery index with %d apps", len(apps))
+def _write_if_changed(store: AppStore, path: Path, content: str) -> bool:
+    """Write ``content`` unless the file already holds it. Returns True if written."""
+    sha = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    if path.exists() and store.page_hash(path.name) == sha:
+        return False
+    with open(path, "w") as f:
+        f.write(content)
+    store.set_page_hash(path.name, sha)
+    return True
 
-    # Benchmark page
-    benchmark_template = env.get_template("benchmark_template.html")
-    benchmark_html = benchmark_template.render(apps=apps)
 
-    benchmark_path = Path(repo_path) / "benchmark.html"
-    with open(benchmark_path, "w") as f:
-        f.write(benchmark_html)
+def update_index(repo_path: str, template_dir: str = "templates",
+                 slugs: list[str] | None = None) -> None:
+    """Regenerate the gallery index.html and benchmark.html from all app metadata.
 
-    logger.info("Updated benchmark page")
+    Only apps that are new, whose metadata changed, or that are listed in
+    ``slugs`` are rendered; the rest come from the fragment cache.
+    """
+    env = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
+    card_template = env.get_template("gallery_card.html")
+    row_template = env.get_template("benchmark_row.html")
+    template_sha = _template_sha(env)
+
+    with open_store(repo_path) as store:
+        stale = store.stale_fragments(template_sha, slugs)
+        store.save_fragments(template_sha, [
+            (app["dir_name"], card_template.render(app=app),
+             row_template.render(app=app) if "benchmark" in app else "")
+            for app in stale
+        ])
+        cards, rows = store.fragments()
+        categories = store.categories()
+        summary = store.benchmark_summary()
+        logger.info("Found %d apps (%d rendered)", len(cards), len(stale))
+
+        # Gallery page
+        gallery_template = env.get_template("gallery_template.html")
+        gallery_html = gallery_template.render(cards=Markup("\n".join(cards)),
+                                               categories=categories)
+        if _write_if_changed(store, Path(repo_path) / "index.html", gallery_html):
+            logger.info("Updated gallery index with %d apps", len(cards))
+
+        # Benchmark page
+        benchmark_template = env.get_template("benchmark_template.html")
+        benchmark_html = benchmark_template.render(rows=Markup("\n".join(rows)),
+                                                   summary=summary)
+        if _write_if_changed(store, Path(repo_path) / "benchmark.html", benchmark_html):
+            logger.info("Updated benchmark page")
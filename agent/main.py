@@ -5,19 +5,27 @@ import json
 import logging
 import os
 import platform
+import signal
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 
-import requests
 import schedule
 
-from agent.code_generator import generate_code
+from agent.analyzer import analyze_html, budget_metrics, check_budgets, is_lighter
+from agent.code_generator import can_optimize, generate_code, generate_plan, optimize_code
 from agent.config import AppConfig, load_config
+from agent.embeddings import check_semantic_duplicate, record_embedding
 from agent.git_committer import commit_app, init_repo
-from agent.idea_generator import generate_idea
+from agent.idea_generator import existing_apps, next_idea, record_app
 from agent.index_updater import update_index
+from agent.minify import minify_html, write_precompressed
+from agent.ollama_client import cancel_all, get_client
+from agent.repair import repair_html, repair_with_llm
+from agent.store import AppStore
 from agent.validator import validate_html
 
 logging.basicConfig(
@@ -36,73 +44,222 @@ def _get_hardware_info(config: AppConfig) -> dict:
         "model_name": config.ollama.model,
     }
 
+    client = get_client(config.ollama)
+
     # Query Ollama for model details (includes GPU/parameter info)
     try:
-        resp = requests.post(
-            f"{config.ollama.url}/api/show",
-            json={"name": config.ollama.model},
-            timeout=10,
-        )
-        if resp.ok:
-            data = resp.json()
-            details = data.get("details", {})
-            info["parameter_size"] = details.get("parameter_size", "unknown")
-            info["quantization"] = details.get("quantization_level", "unknown")
-            info["family"] = details.get("family", "unknown")
+        data = client.show(timeout=10)
+        details = data.get("details", {})
+        info["parameter_size"] = details.get("parameter_size", "unknown")
+        info["quantization"] = details.get("quantization_level", "unknown")
+        info["family"] = details.get("family", "unknown")
     except Exception:
         pass
 
     # Try to get GPU info from Ollama's /api/ps (running models)
     try:
-        resp = requests.get(f"{config.ollama.url}/api/ps", timeout=10)
-        if resp.ok:
-            models = resp.json().get("models", [])
-            for m in models:
-                if config.ollama.model in m.get("name", ""):
-                    info["gpu_layers"] = m.get("details", {}).get("gpu_layers", "unknown")
-                    size_vram = m.get("size_vram", 0)
-                    if size_vram:
-                        info["vram_gb"] = round(size_vram / (1024**3), 1)
-                    break
+        models = client.ps(timeout=10).get("models", [])
+        for m in models:
+            if config.ollama.model in m.get("name", ""):
+                info["gpu_layers"] = m.get("details", {}).get("gpu_layers", "unknown")
+                size_vram = m.get("size_vram", 0)
+                if size_vram:
+                    info["vram_gb"] = round(size_vram / (1024**3), 1)
+                break
     except Exception:
         pass
 
     return info
 
 
+def _repair_and_validate(config: AppConfig, idea: dict, html: str,
+                         record: dict) -> tuple[str, bool]:
+    """Run local repair, validation and, if still invalid, an LLM repair pass.
+
+    Outcomes are written into the attempt ``record``. Returns (html, is_valid).
+    """
+    if config.generation.local_repair:
+        html, repairs = repair_html(html, idea["title"])
+        if repairs:
+            record["repairs"] = repairs
+
+    is_valid, errors = validate_html(html)
+    if not is_valid and config.generation.llm_repair:
+        try:
+            html, record["llm_repair"] = repair_with_llm(config, html, errors)
+        except Exception as e:
+            logger.error("LLM repair failed: %s", e)
+        else:
+            if config.generation.local_repair:
+                html, _ = repair_html(html, idea["title"])
+            is_valid, errors = validate_html(html)
+
+    if is_valid and config.budget.enforce:
+        errors = check_budgets(analyze_html(html), config.budget)
+        is_valid = not errors
+
+    record["valid"] = is_valid
+    if not is_valid:
+        logger.warning("Validation failed: %s", "; ".join(errors))
+        record["errors"] = errors
+    return html, is_valid
+
+
+def _optimize(config: AppConfig, idea: dict, html: str,
+              perf: dict) -> tuple[str, dict, dict]:
+    """Run one optimization pass over an app with budget findings.
+
+    The rewrite is kept only if it validates and is lighter. Returns
+    (html, perf, info) where info holds the before/after figures.
+    """
+    info = {"accepted": False, "findings": perf["findings"], "before": budget_metrics(perf)}
+    if not can_optimize(config, idea, html, perf["findings"]):
+        logger.info("Skipping optimization: the app does not fit in the model's context twice")
+        info["skipped"] = "document too large to rewrite within ollama.num_ctx"
+        return html, perf, info
+    try:
+        optimized, info["benchmark"] = optimize_code(config, idea, html, perf["findings"])
+    except Exception as e:
+        logger.error("Optimization pass failed: %s", e)
+        info["errors"] = [str(e)]
+        return html, perf, info
+
+    if config.generation.local_repair:
+        optimized, _ = repair_html(optimized, idea["title"])
+    is_valid, errors = validate_html(optimized)
+    after = analyze_html(optimized)
+    after["findings"] = check_budgets(after, config.budget)
+    info["after"] = budget_metrics(after)
+    if not is_valid:
+        info["errors"] = errors
+    elif is_lighter(perf, after):
+        info["accepted"] = True
+        logger.info("Kept optimized version (%d -> %d bytes, %d -> %d findings)",
+                    perf["total_bytes"], after["total_bytes"],
+                    len(perf["findings"]), len(after["findings"]))
+        return optimized, after, info
+    logger.info("Discarded optimized version (valid=%s)", is_valid)
+    return html, perf, info
+
+
+def _generate_candidates(config: AppConfig, idea: dict, plan: dict, temperature: float,
+                         record: dict) -> tuple[str | None, dict | None]:
+    """Generate phase-2 candidates concurrently; the first valid one wins.
+
+    Candidates use staggered temperatures starting at ``temperature``. As soon
+    as one passes validation the others are cancelled, which shuts down their
+    connections so Ollama frees the slots.
+    """
+    gen = config.generation
+    cancel = threading.Event()
+    record["candidates"] = []
+    winner: tuple[str | None, dict | None] = (None, None)
+
+    with ThreadPoolExecutor(max_workers=gen.parallel_candidates) as pool:
+        futures = {}
+        for i in range(gen.parallel_candidates):
+            temp = temperature + i * gen.temperature_increment
+            candidate = {"temperature": round(temp, 2)}
+            record["candidates"].append(candidate)
+            future = pool.submit(generate_code, config, idea, temp, plan, cancel)
+            futures[future] = candidate
+
+        for future in as_completed(futures):
+            candidate = futures[future]
+            if cancel.is_set():
+                candidate["cancelled"] = True
+                continue
+            try:
+                html, benchmark = future.result()
+            except Exception as e:
+                logger.error("Candidate at temperature %.2f failed: %s",
+                             candidate["temperature"], e)
+                candidate["errors"] = [str(e)]
+                continue
+            html, is_valid = _repair_and_validate(config, idea, html, candidate)
+            if is_valid:
+                logger.info("Candidate at temperature %.2f passed, cancelling the rest",
+                            candidate["temperature"])
+                cancel.set()
+                get_client(config.ollama).cancel(cancel)
+                for other in futures:
+                    other.cancel()
+                benchmark["temperature"] = candidate["temperature"]
+                winner = (html, benchmark)
+
+    record["valid"] = winner[0] is not None
+    return winner
+
+
 def run_daily_cycle(config: AppConfig) -> bool:
     """Execute one full generation cycle. Returns True on success."""
     logger.info("=== Starting daily generation cycle ===")
+    cycle_start = time.monotonic()
 
-    # Generate idea
-    try:
-        idea = generate_idea(config)
-    except Exception as e:
-        logger.error("Idea generation failed: %s", e)
+    # Generate idea; a bad or duplicate idea costs one small call, not the day
+    idea = None
+    for attempt in range(1, config.generation.max_retries + 1):
+        try:
+            candidate = next_idea(config)
+            duplicate_of = check_semantic_duplicate(config, candidate,
+                                                    existing_apps(config.git.repo_path))
+            if duplicate_of:
+                raise ValueError(f"Semantic duplicate: {candidate['title']} ~ {duplicate_of}")
+            idea = candidate
+            break
+        except Exception as e:
+            logger.error("Idea generation failed (attempt %d/%d): %s",
+                         attempt, config.generation.max_retries, e)
+    if idea is None:
         return False
 
-    # Generate and validate code with retries
+    # Generate and validate code with retries. The phase-1 plan is kept
+    # across attempts and only regenerated after repeated phase-2 failures.
     html = None
     benchmark = None
     attempt_used = 0
+    attempts = []
+    plan = None
+    plan_failures = 0
+    regen_after = config.generation.plan_regen_after
     for attempt in range(1, config.generation.max_retries + 1):
         temp = config.generation.temperature + (attempt - 1) * config.generation.temperature_increment
         logger.info("Generation attempt %d/%d (temperature=%.2f)",
                      attempt, config.generation.max_retries, temp)
 
+        if plan is not None and regen_after and plan_failures >= regen_after:
+            logger.info("Regenerating plan after %d failed code attempts", plan_failures)
+            plan = None
+        record = {
+            "attempt": attempt,
+            "temperature": round(temp, 2),
+            "phases": ["code"] if plan is not None else ["plan", "code"],
+        }
+        attempts.append(record)
+
         try:
-            html, benchmark = generate_code(config, idea, temperature=temp)
+            if plan is None:
+                plan = generate_plan(config, idea, temperature=temp)
+                plan_failures = 0
+            if config.generation.parallel_candidates > 1:
+                html, benchmark = _generate_candidates(config, idea, plan, temp, record)
+            else:
+                html, benchmark = generate_code(config, idea, temperature=temp, plan=plan)
+                html, _ = _repair_and_validate(config, idea, html, record)
         except Exception as e:
             logger.error("Code generation failed: %s", e)
+            record["errors"] = [str(e)]
+            if plan is not None:
+                plan_failures += 1
             continue
 
-        is_valid, errors = validate_html(html)
-        if is_valid:
+        if record.get("valid"):
             logger.info("Validation passed on attempt %d", attempt)
             attempt_used = attempt
+            benchmark["plan_reused"] = "plan" not in record["phases"]
             break
         else:
-            logger.warning("Validation failed: %s", "; ".join(errors))
+            plan_failures += 1
             html = None
             benchmark = None
 
@@ -110,6 +267,25 @@ def run_daily_cycle(config: AppConfig) -> bool:
         logger.error("All %d attempts failed for '%s'", config.generation.max_retries, idea["title"])
         return False
 
+    perf = analyze_html(html)
+    perf["findings"] = check_budgets(perf, config.budget)
+    if perf["findings"]:
+        logger.warning("Performance findings: %s", "; ".join(perf["findings"]))
+        if config.budget.optimize:
+            html, perf, benchmark["optimization"] = _optimize(config, idea, html, perf)
+
+    sizes = {"raw_bytes": len(html.encode("utf-8"))}
+    if config.publish.minify:
+        minified = minify_html(html)
+        is_valid, errors = validate_html(minified)
+        if is_valid:
+            if len(minified) < len(html):
+                html = minified
+        else:
+            logger.warning("Minified HTML failed validation, publishing it unminified: %s",
+                           "; ".join(errors))
+        sizes["minified_bytes"] = len(html.encode("utf-8"))
+
     # Write files
     app_dir = Path(config.git.repo_path) / idea["slug"]
     app_dir.mkdir(parents=True, exist_ok=True)
@@ -117,6 +293,9 @@ def run_daily_cycle(config: AppConfig) -> bool:
     # Write HTML
     with open(app_dir / "index.html", "w") as f:
         f.write(html)
+    if config.publish.precompress:
+        sizes.update({f"{name}_bytes": size for name, size
+                      in write_precompressed(app_dir / "index.html").items()})
 
     # Collect hardware/model info
     hw_info = _get_hardware_info(config)
@@ -128,9 +307,13 @@ def run_daily_cycle(config: AppConfig) -> bool:
         "category": idea["category"],
         "slug": idea["slug"],
         "date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+        "perf": perf,
+        "sizes": sizes,
         "benchmark": {
             **(benchmark or {}),
+            "idea": idea.get("timings", {}),
             "attempt": attempt_used,
+            "attempts": attempts,
             "model": hw_info.get("model_name", config.ollama.model),
             "parameter_size": hw_info.get("parameter_size", "unknown"),
             "quantization": hw_info.get("quantization", "unknown"),
@@ -139,16 +322,19 @@ def run_daily_cycle(config: AppConfig) -> bool:
             "arch": hw_info.get("arch", "unknown"),
             "vram_gb": hw_info.get("vram_gb"),
             "compute": os.environ.get("COMPUTE_INFO", "unknown"),
+            "ollama_calls": get_client(config.ollama).call_summary(cycle_start),
         },
     }
     with open(app_dir / "metadata.json", "w") as f:
         json.dump(metadata, f, indent=2)
+    with AppStore(config.git.repo_path) as store:
+        store.record(idea["slug"], metadata)
 
     logger.info("Wrote app to %s", app_dir)
 
     # Update gallery index
     try:
-        update_index(config.git.repo_path)
+        update_index(config.git.repo_path, slugs=[idea["slug"]])
     except Exception as e:
         logger.error("Gallery update failed: %s", e)
         return False
@@ -163,10 +349,23 @@ def run_daily_cycle(config: AppConfig) -> bool:
         logger.error("Git commit error: %s", e)
         return False
 
+    try:
+        record_app(config, idea)
+        record_embedding(config, idea)
+    except Exception as e:
+        logger.warning("Failed to update near-duplicate index: %s", e)
+
     logger.info("=== Successfully generated: %s ===", idea["title"])
     return True
 
 
+def _handle_sigterm(signum, frame):
+    """Abort in-flight generations so Ollama frees its slots, then exit."""
+    logger.warning("Received signal %d, cancelling in-flight generations", signum)
+    cancel_all()
+    sys.exit(128 + signum)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Autonomous SPA Development Agent")
     parser.add_argument("--once", action="store_true", help="Run once and exit")
@@ -174,6 +373,7 @@ def main():
     args = parser.parse_args()
 
     config = load_config(args.config)
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     logger.info("Loaded config: model=%s, url=%s", config.ollama.model, config.ollama.url)
 
     # Initialize git repo
@@ -0,0 +1,249 @@
+"""Conservative minification of generated apps and precompressed copies for serving.
+
+Only transformations that cannot change behaviour are applied: comments
+and redundant whitespace are removed, but line breaks in scripts are kept
+so automatic semicolon insertion still sees them.
+"""
+
+import gzip
+import logging
+import re
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import esprima
+except ImportError:  # pragma: no cover - optional dependency
+    esprima = None
+
+from agent.validator import JS_SCRIPT_TYPES
+
+logger = logging.getLogger(__name__)
+
+_RAW_BLOCK = re.compile(r"(<(script|style|pre|textarea)\b[^>]*>)(.*?)(</\2\s*>)",
+                        re.IGNORECASE | re.DOTALL)
+_TYPE_ATTR = re.compile(r"""\btype\s*=\s*["']?([^"'\s>]*)""", re.IGNORECASE)
+_HTML_COMMENT = re.compile(r"<!--(?!\[).*?-->", re.DOTALL)
+_INDENT_BETWEEN_TAGS = re.compile(r">[ \t]*\n\s*<")
+_PLACEHOLDER = re.compile(r"<\0(\d+)\0>")
+_CSS_TOKEN = re.compile(r"""/\*.*?\*/|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^"'/]+|/""", re.DOTALL)
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*|(:)\s+")
+# A "/" after one of these starts a regex literal rather than a division
+_REGEX_PREFIX = set("(,=:[!&|?{};+-*%<>~^") | {""}
+_IDENTIFIER = re.compile(r"[\w$]+")
+_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new", "delete",
+                   "void", "throw", "instanceof", "yield", "await"}
+
+
+def minify_css(css: str) -> str:
+    """Drop comments and whitespace around CSS punctuation outside strings."""
+    out = []
+    for token in _CSS_TOKEN.findall(css):
+        if token.startswith("/*"):
+            continue
+        if token[0] in "\"'":
+            out.append(token)
+            continue
+        token = re.sub(r"\s+", " ", token)
+        token = _CSS_PUNCTUATION.sub(r"\1\2", token)
+        out.append(token.replace(";}", "}"))
+    return "".join(out).strip()
+
+
+def _skip_quoted(js: str, i: int) -> int:
+    """Index just past the string or template literal starting at ``i``."""
+    quote, n = js[i], len(js)
+    i += 1
+    while i < n:
+        ch = js[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == quote:
+            return i + 1
+        if quote == "`" and js.startswith("${", i):
+            i = _skip_braces(js, i + 1)
+            continue
+        i += 1
+    return n
+
+
+def _skip_braces(js: str, i: int) -> int:
+    """Index just past the ``}`` matching the ``{`` at ``i``, skipping literals."""
+    depth, n = 0, len(js)
+    while i < n:
+        ch = js[i]
+        if ch in "\"'`":
+            i = _skip_quoted(js, i)
+            continue
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def _skip_regex(js: str, i: int) -> int:
+    """Index just past the regex literal starting at ``i`` (stops at a newline)."""
+    n, in_class = len(js), False
+    i += 1
+    while i < n and js[i] != "\n":
+        ch = js[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            in_class = True
+        elif ch == "]":
+            in_class = False
+        elif ch == "/" and not in_class:
+            return i + 1
+        i += 1
+    return i
+
+
+def _js_segments(js: str):
+    """Yield (kind, text) runs of code, literals and comments."""
+    i, n = 0, len(js)
+    code_start = 0
+    last = ""  # last significant code character, to tell regexes from division
+    word = ""  # last identifier or keyword
+    while i < n:
+        ch = js[i]
+        if ch in "\"'`":
+            end, kind = _skip_quoted(js, i), "literal"
+        elif js.startswith("//", i):
+            end = js.find("\n", i)
+            end, kind = (n if end == -1 else end), "comment"
+        elif js.startswith("/*", i):
+            end = js.find("*/", i + 2)
+            end, kind = (n if end == -1 else end + 2), "comment"
+        elif ch == "/" and (last in _REGEX_PREFIX or (last == "a" and word in _REGEX_KEYWORDS)):
+            end, kind = _skip_regex(js, i), "literal"
+        else:
+            ident = _IDENTIFIER.match(js, i)
+            if ident:
+                last, word = "a", ident.group()
+                i = ident.end()
+                continue
+            if not ch.isspace():
+                last, word = ch, ""
+            i += 1
+            continue
+        if code_start < i:
+            yield "code", js[code_start:i]
+        yield kind, js[i:end]
+        if kind == "literal":
+            last, word = ")", ""
+        i = code_start = end
+    if code_start < n:
+        yield "code", js[code_start:]
+
+
+def _joins(left: str, right: str) -> bool:
+    """True if ``left`` and ``right`` would merge into one token when adjacent."""
+    if _IDENTIFIER.match(left) and _IDENTIFIER.match(right):
+        return True
+    return left == right and left in "+-"
+
+
+def minify_js(js: str) -> str:
+    """Drop comments and indentation; line breaks are kept for ASI."""
+    out = []
+    dropped = False  # a comment was just removed
+    for kind, text in _js_segments(js):
+        if kind == "comment":
+            if out and out[-1] and out[-1][-1] not in "\"'`/":
+                out[-1] = out[-1].rstrip(" \t")
+            if text.startswith("/*") and "\n" in text and not (out and out[-1].endswith("\n")):
+                out.append("\n")
+            dropped = True
+            continue
+        if kind == "code":
+            text = re.sub(r"[ \t]+", " ", text)
+            text = re.sub(r" ?\n[\s]*", "\n", text)
+            # Blank lines are only collapsed here, never inside literals
+            if text.startswith("\n") and out and out[-1].endswith("\n"):
+                text = text[1:]
+            if not text:
+                continue
+        # Keep the separation the comment provided, e.g. in return/**/x
+        if dropped and text and out and out[-1] and _joins(out[-1][-1], text[0]):
+            text = " " + text
+        dropped = False
+        out.append(text)
+    return "".join(out).strip()
+
+
+def _same_tokens(original: str, minified: str) -> bool:
+    """Check with esprima that minification kept every JS token.
+
+    Returns False when the check cannot run, i.e. without esprima or for a
+    script it cannot tokenize (newer syntax), so only verified scripts are
+    minified.
+    """
+    if esprima is None:
+        return False
+    try:
+        before = esprima.tokenize(original)
+        after = esprima.tokenize(minified)
+    except Exception:
+        return False
+    return [(t.type, t.value) for t in before] == [(t.type, t.value) for t in after]
+
+
+def _minify_markup(markup: str) -> str:
+    """Drop comments and indentation between tags; text content is left alone."""
+    markup = _HTML_COMMENT.sub("", markup)
+    return _INDENT_BETWEEN_TAGS.sub(">\n<", markup)
+
+
+def minify_html(html: str) -> str:
+    """Minify markup and inline CSS/JS; <pre> and <textarea> are left alone."""
+    blocks = []
+
+    def stash(match: re.Match) -> str:
+        open_tag, tag, body, close_tag = match.groups()
+        tag = tag.lower()
+        type_match = _TYPE_ATTR.search(open_tag)
+        script_type = type_match.group(1).lower() if type_match else ""
+        if tag == "style":
+            body = minify_css(body)
+        elif tag == "script" and script_type in JS_SCRIPT_TYPES:
+            minified = minify_js(body)
+            if _same_tokens(body, minified):
+                body = minified
+            elif minified != body:
+                logger.info("Could not verify the minified script's tokens, keeping it as is")
+        blocks.append(open_tag + body + close_tag)
+        return f"<\0{len(blocks) - 1}\0>"
+
+    # Raw-text blocks are swapped for placeholders so the markup pass sees
+    # them as tags but never touches their contents
+    markup = _minify_markup(_RAW_BLOCK.sub(stash, html))
+    result = _PLACEHOLDER.sub(lambda m: blocks[int(m.group(1))], markup).strip()
+    return result + "\n" if html.endswith("\n") else result
+
+
+def write_precompressed(path: Path) -> dict:
+    """Write ``.gz`` (and ``.br`` if brotli is installed) next to ``path``.
+
+    Returns the compressed sizes in bytes, keyed ``gzip`` and ``brotli``.
+    """
+    data = path.read_bytes()
+    sizes = {}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    path.with_name(path.name + ".gz").write_bytes(gz)
+    sizes["gzip"] = len(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        path.with_name(path.name + ".br").write_bytes(br)
+        sizes["brotli"] = len(br)
+    return sizes
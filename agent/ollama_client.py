@@ -0,0 +1,377 @@
+"""Shared HTTP client for the Ollama API with connection pooling and telemetry."""
+
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from agent.config import OllamaConfig
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CallRecord:
+    """Telemetry for a single Ollama API call."""
+    endpoint: str
+    status: int | None
+    seconds: float
+    response_bytes: int
+    error: str | None = None
+    started: float = 0.0  # time.monotonic() when the call was issued
+
+
+@dataclass
+class StreamMetrics:
+    """Client-side latency figures for one streamed generation."""
+    first_token_seconds: float | None = None
+    total_seconds: float = 0.0
+    chunks: int = 0
+    tokens: int = 0
+    tokens_per_second: float | None = None
+
+    def extend(self, other: "StreamMetrics") -> None:
+        """Fold in a follow-up request (e.g. a continuation) of the same generation."""
+        self.total_seconds += other.total_seconds
+        self.chunks += other.chunks
+        self.tokens += other.tokens
+        if self.first_token_seconds is not None:
+            gen_seconds = self.total_seconds - self.first_token_seconds
+            if gen_seconds > 0:
+                self.tokens_per_second = round(self.tokens / gen_seconds, 1)
+
+    def as_benchmark(self, prefix: str) -> dict:
+        """Flatten into benchmark keys, e.g. ``phase2_first_token_seconds``."""
+        return {
+            f"{prefix}_first_token_seconds": (
+                round(self.first_token_seconds, 2)
+                if self.first_token_seconds is not None else None
+            ),
+            f"{prefix}_tokens": self.tokens,
+            f"{prefix}_tokens_per_second": self.tokens_per_second,
+        }
+
+
+def server_timings(data: dict) -> dict:
+    """Extract Ollama's server-side counters from a generate response.
+
+    Durations are converted from nanoseconds to seconds, and prompt and
+    generation throughput are derived from them. Returns an empty dict when
+    the response carries no counters (e.g. a stream closed before its final
+    chunk).
+    """
+    if "eval_count" not in data and "total_duration" not in data:
+        return {}
+    ns = 1e9
+    timings = {
+        "total_seconds": round(data.get("total_duration", 0) / ns, 3),
+        "load_seconds": round(data.get("load_duration", 0) / ns, 3),
+        "prompt_eval_count": data.get("prompt_eval_count", 0),
+        "prompt_eval_seconds": round(data.get("prompt_eval_duration", 0) / ns, 3),
+        "eval_count": data.get("eval_count", 0),
+        "eval_seconds": round(data.get("eval_duration", 0) / ns, 3),
+    }
+    timings["prompt_tokens_per_second"] = (
+        round(timings["prompt_eval_count"] / timings["prompt_eval_seconds"], 1)
+        if timings["prompt_eval_seconds"] else None
+    )
+    timings["eval_tokens_per_second"] = (
+        round(timings["eval_count"] / timings["eval_seconds"], 1)
+        if timings["eval_seconds"] else None
+    )
+    return timings
+
+
+PROGRESS_LOG_INTERVAL = 15.0  # seconds between live progress lines while streaming
+
+
+class OllamaClient:
+    """Keep-alive session to one Ollama server.
+
+    Connection setup is paid once per process instead of once per request.
+    Connect failures are retried (the request never reached the server, so
+    this is safe for POST); anything after that surfaces as RuntimeError.
+    """
+
+    def __init__(self, config: OllamaConfig):
+        self.config = config
+        self.calls: deque[CallRecord] = deque(maxlen=256)
+        self._lock = threading.Lock()
+        self._inflight: list[dict] = []
+        self._last_used = 0.0
+        self._session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        retry = Retry(
+            total=self.config.max_retries,
+            connect=self.config.max_retries,
+            read=0,
+            status=0,
+            backoff_factor=0.5,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.config.pool_size,
+            max_retries=retry,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get_session(self) -> requests.Session:
+        """Return the pooled session, dropping connections that sat idle too long.
+
+        Ollama's HTTP server closes idle keep-alive sockets on its own; reusing
+        one of those fails on the first write, so recycle the pool instead.
+        Connections count as idle from the end of the last call, and the pool
+        is never recycled while a stream is still open.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (self._last_used and not self._inflight
+                    and now - self._last_used > self.config.idle_timeout):
+                logger.debug("Ollama connections idle for %.0fs, recycling pool",
+                             now - self._last_used)
+                self._session.close()
+                self._session = self._new_session()
+            self._last_used = now
+            return self._session
+
+    def _request(self, method: str, path: str, timeout: float | None = None,
+                 **kwargs) -> requests.Response:
+        """Issue a request, record telemetry and raise on HTTP errors."""
+        read_timeout = timeout if timeout is not None else self.config.timeout
+        session = self._get_session()
+        t0 = time.monotonic()
+        try:
+            response = session.request(
+                method,
+                f"{self.config.url}{path}",
+                timeout=(self.config.connect_timeout, read_timeout),
+                **kwargs,
+            )
+        except requests.RequestException as e:
+            self._record(path, None, t0, 0, str(e))
+            raise RuntimeError(f"Ollama {path} failed: {e}") from e
+
+        # A streamed body is consumed, and its call recorded, by the caller
+        if not (kwargs.get("stream") and response.ok):
+            self._record(path, response.status_code, t0, len(response.content),
+                         None if response.ok else response.reason)
+        if not response.ok:
+            error_body = response.text[:500]
+            raise RuntimeError(f"Ollama {response.status_code}: {error_body}")
+        return response
+
+    def _record(self, path: str, status: int | None, t0: float,
+                response_bytes: int, error: str | None) -> None:
+        record = CallRecord(
+            endpoint=path,
+            status=status,
+            seconds=round(time.monotonic() - t0, 3),
+            response_bytes=response_bytes,
+            error=error,
+            started=t0,
+        )
+        self.calls.append(record)
+        with self._lock:
+            self._last_used = time.monotonic()
+        logger.debug("Ollama %s -> %s in %.2fs (%d bytes)",
+                     path, status, record.seconds, response_bytes)
+
+    def generate(self, prompt: str, options: dict, model: str | None = None,
+                 cancel: threading.Event | None = None, **extra) -> dict:
+        """Call /api/generate and return the complete response.
+
+        The streaming transport is used underneath so the request can be
+        aborted (see generate_stream); the result has the same shape as a
+        non-streaming response.
+        """
+        data, _ = self.generate_stream(prompt, options, model=model, cancel=cancel, **extra)
+        return data
+
+    def generate_stream(self, prompt: str, options: dict,
+                        on_text: Callable[[str], bool | None] | None = None,
+                        model: str | None = None, cancel: threading.Event | None = None,
+                        **extra) -> tuple[dict, StreamMetrics]:
+        """Call /api/generate with NDJSON streaming.
+
+        ``on_text`` receives each text fragment as it arrives; returning a
+        truthy value stops reading and closes the connection. Returns the
+        final response (``response`` holds the concatenated text, plus any
+        counters from the closing chunk) and the client-side metrics.
+
+        The connection is shut down, so Ollama stops generating, when
+        ``ollama.timeout`` elapses, when cancel() is called with ``cancel``,
+        or on cancel_all(). Each of these raises RuntimeError.
+        """
+        payload = {
+            "model": model or self.config.model,
+            "prompt": prompt,
+            "stream": True,
+            "options": options,
+            **extra,
+        }
+        t0 = time.monotonic()
+        response = self._request("POST", "/api/generate", json=payload, stream=True)
+
+        handle = {"response": response, "cancel": cancel, "reason": None}
+        with self._lock:
+            self._inflight.append(handle)
+        deadline = threading.Timer(self.config.timeout - (time.monotonic() - t0),
+                                   self._abort, (handle, "timed out"))
+        deadline.daemon = True
+        deadline.start()
+        if cancel is not None and cancel.is_set():
+            self._abort(handle, "cancelled")
+
+        metrics = StreamMetrics()
+        parts: list[str] = []
+        final: dict = {}
+        last_log = t0
+        received = 0
+        error = None
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                received += len(line)
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    error = str(chunk["error"])
+                    raise RuntimeError(f"Ollama stream error: {chunk['error']}")
+                now = time.monotonic()
+                text = chunk.get("response", "")
+                if text:
+                    if metrics.first_token_seconds is None:
+                        metrics.first_token_seconds = now - t0
+                    metrics.chunks += 1
+                    parts.append(text)
+                if now - last_log >= PROGRESS_LOG_INTERVAL:
+                    logger.info("Streaming: %d tokens after %.0fs", metrics.chunks, now - t0)
+                    last_log = now
+                stop = bool(text and on_text is not None and on_text(text))
+                if chunk.get("done"):
+                    final = chunk
+                    break
+                if stop:
+                    logger.debug("Stream stopped by caller after %d tokens", metrics.chunks)
+                    break
+        except requests.RequestException as e:
+            error = str(e)
+            if handle["reason"]:
+                raise RuntimeError(f"Ollama generation {handle['reason']}") from e
+            raise RuntimeError(f"Ollama stream failed: {e}") from e
+        finally:
+            deadline.cancel()
+            with self._lock:
+                self._inflight.remove(handle)
+            response.close()
+            self._record("/api/generate", response.status_code, t0, received,
+                         handle["reason"] or error)
+        if handle["reason"]:
+            raise RuntimeError(f"Ollama generation {handle['reason']}")
+
+        metrics.total_seconds = time.monotonic() - t0
+        metrics.tokens = final.get("eval_count") or metrics.chunks
+        if metrics.first_token_seconds is not None:
+            gen_seconds = metrics.total_seconds - metrics.first_token_seconds
+            if gen_seconds > 0:
+                metrics.tokens_per_second = round(metrics.tokens / gen_seconds, 1)
+
+        result = {**final, "response": "".join(parts)}
+        result.setdefault("done", False)
+        return result, metrics
+
+    @staticmethod
+    def _abort(handle: dict, reason: str) -> None:
+        """Shut down a stream's socket so both the reader and Ollama stop now.
+
+        Shutting the socket down (rather than closing the response) is safe
+        from another thread and wakes a reader blocked in recv().
+        """
+        if handle["reason"]:
+            return
+        handle["reason"] = reason
+        logger.warning("Aborting Ollama generation: %s", reason)
+        try:
+            sock = handle["response"].raw.connection.sock
+            sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
+    def cancel(self, event: threading.Event | None = None) -> int:
+        """Abort in-flight streams started with ``event`` (all streams if None).
+
+        Returns the number of streams aborted.
+        """
+        with self._lock:
+            handles = [h for h in self._inflight if event is None or h["cancel"] is event]
+        for handle in handles:
+            self._abort(handle, "cancelled")
+        return len(handles)
+
+    def show(self, name: str | None = None, timeout: float | None = None) -> dict:
+        """Return model details from /api/show."""
+        payload = {"name": name or self.config.model}
+        return self._request("POST", "/api/show", json=payload, timeout=timeout).json()
+
+    def ps(self, timeout: float | None = None) -> dict:
+        """Return the currently loaded models from /api/ps."""
+        return self._request("GET", "/api/ps", timeout=timeout).json()
+
+    def embed(self, texts: list[str], model: str) -> list[list[float]]:
+        """Return one embedding per input text from /api/embed."""
+        payload = {"model": model, "input": texts}
+        return self._request("POST", "/api/embed", json=payload).json()["embeddings"]
+
+    def call_summary(self, since: float = 0.0) -> dict:
+        """Aggregate the calls issued at or after ``since`` (a time.monotonic() value).
+
+        Returns, per endpoint, the number of calls and errors, the total
+        seconds (a streamed generation counts until its last chunk) and the
+        response bytes.
+        """
+        summary: dict[str, dict] = {}
+        for call in list(self.calls):
+            if call.started < since:
+                continue
+            entry = summary.setdefault(call.endpoint, {
+                "calls": 0, "errors": 0, "seconds": 0.0, "response_bytes": 0,
+            })
+            entry["calls"] += 1
+            entry["errors"] += call.error is not None
+            entry["seconds"] = round(entry["seconds"] + call.seconds, 3)
+            entry["response_bytes"] += call.response_bytes
+        return summary
+
+
+_clients: dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config: OllamaConfig) -> OllamaClient:
+    """Return the process-wide client for this Ollama URL, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(config.url)
+        if client is None or client.config is not config:
+            client = OllamaClient(config)
+            _clients[config.url] = client
+        return client
+
+
+def cancel_all() -> None:
+    """Abort every in-flight generation in this process (e.g. on SIGTERM)."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        client.cancel()
@@ -0,0 +1,253 @@
+"""Repair of structural defects in generated HTML.
+
+Mechanical defects are fixed locally by repair_html(). What is left can be
+sent to the model as a targeted patch request by repair_with_llm(), which
+only ships the validator errors and the broken region of the document.
+"""
+
+import html as html_lib
+import logging
+import re
+import time
+
+from agent.config import AppConfig
+from agent.ollama_client import get_client, server_timings
+from agent.validator import JS_SCRIPT_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Validator errors that point at the start of the document rather than its tail
+_HEAD_ERROR_MARKERS = ("<!doctype", "<html", "<head", "</head>", "title")
+# Validator errors that a local patch cannot fix, or that name no place in
+# the document (an unbalanced tag can be anywhere)
+_UNPATCHABLE_PREFIXES = ("File too", "Over budget", "Mismatched <")
+_JS_ERROR = re.compile(r"JavaScript syntax error in inline script (\d+): Line (\d+)\b")
+_SCRIPT_OPEN = re.compile(r"<script\b([^>]*)>", re.IGNORECASE)
+_TYPE_ATTR = re.compile(r"""\btype\s*=\s*["']?([^"'\s>]*)""", re.IGNORECASE)
+_SRC_ATTR = re.compile(r"\bsrc\s*=", re.IGNORECASE)
+
+
+def _close_raw_text_element(html: str, tag: str,
+                            before: tuple[str, ...]) -> tuple[str, bool]:
+    """Close the last ``<tag>`` element if it was never closed.
+
+    The closing tag goes in front of the first of the ``before`` markers
+    (e.g. ``</body>``) after the open tag, or at the end of the document if
+    there is none.
+    """
+    lower = html.lower()
+    opens = [m.start() for m in re.finditer(rf"<{tag}[\s>]", lower)]
+    if len(opens) <= lower.count(f"</{tag}>"):
+        return html, False
+    last_open = opens[-1]
+    if f"</{tag}>" in lower[last_open:]:
+        return html, False
+    found = [pos for pos in (lower.find(marker, last_open) for marker in before) if pos != -1]
+    pos = min(found, default=len(html))
+    return html[:pos] + f"</{tag}>\n" + html[pos:], True
+
+
+def repair_html(html: str, title: str) -> tuple[str, list[str]]:
+    """Fix mechanical defects that would otherwise fail validation.
+
+    Handles a missing doctype, unclosed <script>/<style> blocks, a missing or
+    empty <title>, and missing </head>, </body> and </html> tags. Anything
+    more serious is left for the validator. Returns (html, applied_repairs).
+    """
+    repairs = []
+
+    if "<html" in html.lower() and not html.lstrip().lower().startswith("<!doctype"):
+        html = "<!DOCTYPE html>\n" + html.lstrip()
+        repairs.append("added <!DOCTYPE html>")
+
+    html, fixed = _close_raw_text_element(html, "style", ("</head>", "<body"))
+    if fixed:
+        repairs.append("closed <style>")
+    html, fixed = _close_raw_text_element(html, "script", ("</body>",))
+    if fixed:
+        repairs.append("closed <script>")
+
+    lower = html.lower()
+    body_open = re.search(r"<body[\s>]", lower)
+    if "</head>" not in lower and "<head" in lower and body_open:
+        html = html[:body_open.start()] + "</head>\n" + html[body_open.start():]
+        repairs.append("added </head>")
+
+    safe_title = html_lib.escape(title)
+    title_match = re.search(r"<title>(.*?)</title>", html, re.IGNORECASE | re.DOTALL)
+    if title_match and not title_match.group(1).strip():
+        html = html[:title_match.start(1)] + safe_title + html[title_match.end(1):]
+        repairs.append("filled empty <title>")
+    elif not title_match:
+        head_open = re.search(r"<head(\s[^>]*)?>", html, re.IGNORECASE)
+        if head_open:
+            html = (html[:head_open.end()] + f"\n<title>{safe_title}</title>"
+                    + html[head_open.end():])
+            repairs.append("added <title>")
+
+    lower = html.lower()
+    if "</body>" not in lower and body_open:
+        pos = lower.rfind("</html>")
+        pos = len(html) if pos == -1 else pos
+        html = html[:pos].rstrip() + "\n</body>\n" + html[pos:]
+        repairs.append("added </body>")
+    if "</html>" not in html.lower() and "<html" in lower:
+        html = html.rstrip() + "\n</html>"
+        repairs.append("added </html>")
+
+    if repairs:
+        logger.info("Applied local repairs: %s", ", ".join(repairs))
+    return html, repairs
+
+
+def _script_region(html: str, number: int, line: int,
+                   max_chars: int) -> tuple[int, int] | None:
+    """Span of at most ``max_chars`` around ``line`` of inline script ``number``.
+
+    Scripts are counted the way the validator counts them: inline scripts
+    whose type holds JavaScript, starting at 1.
+    """
+    count = 0
+    for match in _SCRIPT_OPEN.finditer(html):
+        attrs = match.group(1)
+        script_type = _TYPE_ATTR.search(attrs)
+        script_type = script_type.group(1).strip().lower() if script_type else ""
+        if _SRC_ATTR.search(attrs) or script_type not in JS_SCRIPT_TYPES:
+            continue
+        count += 1
+        if count == number:
+            break
+    else:
+        return None
+    body_start = match.end()
+    body_end = html.lower().find("</script>", body_start)
+    body_end = len(html) if body_end == -1 else body_end
+    pos = body_start
+    for _ in range(line - 1):
+        pos = html.find("\n", pos, body_end)
+        if pos == -1:
+            return None
+        pos += 1
+    start = max(body_start, pos - max_chars // 2)
+    if start > body_start:
+        start = html.find("\n", start, pos) + 1 or start
+    end = min(body_end, start + max_chars)
+    if end < body_end:
+        end = html.rfind("\n", pos, end) + 1 or end
+    return start, end
+
+
+def _failing_regions(html: str, errors: list[str], max_chars: int) -> list[tuple[int, int, str]]:
+    """Pick the document regions that the validator errors point at.
+
+    Returns non-overlapping (start, end, label) tuples in document order:
+    the head of the document, the part of each inline script around a
+    syntax error, and the tail of the document, each no longer than
+    ``max_chars`` (merged neighbours can be longer).
+    """
+    lower = html.lower()
+    regions = []
+    errors = [e for e in errors if not e.startswith(_UNPATCHABLE_PREFIXES)]
+
+    if any(marker in e.lower() for e in errors for marker in _HEAD_ERROR_MARKERS):
+        end = lower.find("</head>")
+        end = end + len("</head>") if end != -1 else lower.find("<body")
+        if end == -1 or end > max_chars:
+            end = min(len(html), max_chars)
+        regions.append((0, end, "start"))
+
+    tail = False
+    for error in errors:
+        js_error = _JS_ERROR.match(error)
+        if js_error:
+            number, line = int(js_error.group(1)), int(js_error.group(2))
+            span = _script_region(html, number, line, max_chars)
+            if span:
+                regions.append((*span, f"inline script {number} around its line {line}"))
+        elif not any(marker in error.lower() for marker in _HEAD_ERROR_MARKERS):
+            tail = True
+
+    if tail:
+        start = max(0, len(html) - max_chars)
+        # Prefer starting at an unclosed <script>/<style> when it fits
+        for tag in ("script", "style"):
+            last_open = lower.rfind(f"<{tag}")
+            if last_open >= start and f"</{tag}>" not in lower[last_open:]:
+                start = last_open
+                break
+        else:
+            newline = html.find("\n", start)
+            if start and newline != -1:
+                start = newline + 1
+        regions.append((start, len(html), "end"))
+
+    merged: list[tuple[int, int, str]] = []
+    for start, end, label in sorted(regions):
+        if merged and start < merged[-1][1]:
+            prev_start, prev_end, prev_label = merged[-1]
+            merged[-1] = (prev_start, max(prev_end, end), prev_label)
+        else:
+            merged.append((start, end, label))
+    return merged
+
+
+def _describe(label: str) -> str:
+    if label in ("start", "end"):
+        return f"the {label} of the document"
+    return f"part of {label}"
+
+
+def repair_with_llm(config: AppConfig, html: str, errors: list[str]) -> tuple[str, dict]:
+    """Ask the model to patch only the regions of ``html`` that failed validation.
+
+    Uses ``generation.repair_model`` when set, so a smaller model can do the
+    patching. Returns (html, info) where info records the regions patched,
+    the model and the time spent; a patch that looks like it dropped content
+    is discarded.
+    """
+    gen = config.generation
+    model = gen.repair_model or config.ollama.model
+    error_list = "\n".join(f"- {e}" for e in errors)
+    info = {"model": model, "regions": [], "seconds": 0.0}
+
+    t0 = time.monotonic()
+    # Patch back to front so earlier offsets stay valid
+    for start, end, label in reversed(_failing_regions(html, errors, gen.repair_fragment_chars)):
+        fragment = html[start:end]
+        prompt = f"""The following HTML document failed validation with these errors:
+{error_list}
+
+This is {_describe(label)} ({len(fragment)} of {len(html)} characters):
+```html
+{fragment}
+```
+
+Return ONLY the corrected version of this fragment inside a ```html code block.
+It replaces the fragment exactly, so keep everything that is already correct and
+do not add anything that belongs elsewhere in the document."""
+
+        logger.info("Requesting LLM repair of %s (%d chars)", _describe(label), len(fragment))
+        data = get_client(config.ollama).generate(
+            prompt,
+            options={
+                "temperature": 0.2,
+                "num_predict": max(512, len(fragment)),
+            },
+            model=model,
+        )
+        raw = data["response"]
+        block = re.search(r"```(?:html?)?\s*\n(.*?)```", raw, re.DOTALL)
+        patch = (block.group(1) if block else raw).strip("\n")
+        if len(patch.strip()) < len(fragment.strip()) // 2:
+            logger.warning("Discarding LLM repair of %s: patch is too short", _describe(label))
+            continue
+        html = html[:start] + patch + html[end:]
+        info["regions"].append({
+            "region": label,
+            "fragment_chars": len(fragment),
+            "patch_chars": len(patch),
+            "timings": server_timings(data),
+        })
+
+    info["seconds"] = round(time.monotonic() - t0, 1)
+    return html, info
@@ -0,0 +1,223 @@
+"""Lexical similarity search over existing apps for idea deduplication.
+
+TitleIndex ranks existing titles for the idea prompt; MinHashIndex is a
+persistent MinHash/LSH index that flags near-duplicate ideas offline.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+from collections import defaultdict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "an", "and", "app", "application", "for", "in", "of", "on", "the",
+    "to", "with", "your", "that", "this", "is", "by", "from", "web",
+}
+CHARS_PER_TOKEN = 4  # rough estimate, good enough for a prompt budget
+
+
+def tokenize(text: str) -> set[str]:
+    """Lowercase word tokens with stopwords and one-letter words removed."""
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower())
+            if len(w) > 1 and w not in STOPWORDS}
+
+
+class TitleIndex:
+    """Inverted index from tokens to apps, ranked by IDF-weighted overlap.
+
+    A query only touches apps that share at least one token with it, so
+    lookups stay cheap as the number of apps grows. Equal scores are ranked
+    newest first by the apps' ``date``.
+    """
+
+    def __init__(self, apps: list[dict]):
+        self.titles: list[str] = []
+        self.categories: list[str] = []
+        self.dates: list[str] = []
+        self._postings: dict[str, list[int]] = defaultdict(list)
+        for app in apps:
+            doc_id = len(self.titles)
+            self.titles.append(app.get("title", ""))
+            self.categories.append(app.get("category", ""))
+            self.dates.append(str(app.get("date") or ""))
+            text = " ".join((app.get("title", ""), app.get("description", ""),
+                             app.get("category", "")))
+            for token in tokenize(text):
+                self._postings[token].append(doc_id)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _idf(self, token: str) -> float:
+        return math.log(1 + len(self.titles) / (1 + len(self._postings.get(token, ()))))
+
+    def nearest(self, query: str, k: int | None = None,
+                category: str | None = None) -> list[str]:
+        """Return up to ``k`` titles most similar to ``query`` (all matches if None).
+
+        Apps in ``category`` get a bonus so same-category titles come first.
+        """
+        scores: dict[int, float] = defaultdict(float)
+        for token in tokenize(query):
+            weight = self._idf(token)
+            for doc_id in self._postings.get(token, ()):
+                scores[doc_id] += weight
+        if category:
+            for doc_id in self._postings.get(category.lower(), ()):
+                if self.categories[doc_id].lower() == category.lower():
+                    scores[doc_id] += 1.0
+        # Newest first (then in index order) among equal scores; sort is stable
+        ranked = sorted(scores, key=lambda d: (self.dates[d], -d), reverse=True)
+        ranked.sort(key=lambda d: -scores[d])
+        return [self.titles[d] for d in ranked[:k]]
+
+
+def fit_budget(titles: list[str], max_tokens: int) -> list[str]:
+    """Keep titles in order until the estimated token budget is spent."""
+    kept = []
+    used = 0
+    for title in titles:
+        cost = len(title) // CHARS_PER_TOKEN + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(title)
+        used += cost
+    return kept
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MINHASH_SEED = 1  # fixed so signatures stay comparable across runs
+
+
+def _title_shingles(idea: dict) -> set[str]:
+    """Title words, plus adjacent title words as bigrams."""
+    title_words = [w for w in re.findall(r"[a-z0-9]+", idea.get("title", "").lower())
+                   if w not in STOPWORDS]
+    shingles = tokenize(idea.get("title", ""))
+    shingles.update(f"{a}_{b}" for a, b in zip(title_words, title_words[1:]))
+    return shingles
+
+
+def _shingles(idea: dict) -> set[str]:
+    """Tokens of title and description, plus the title bigrams."""
+    return tokenize(idea.get("description", "")) | _title_shingles(idea)
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed with LSH banding, stored as JSON lines.
+
+    Each app is one line (slug, title, signature), so adding an app appends
+    a line instead of rewriting the file. Queries only compare against apps
+    that share at least one band bucket with the query.
+
+    A signature is two MinHashes of ``num_perm`` values each: one of title
+    and description together, one of the title alone. An idea's similarity
+    is the higher of the two estimates, so a long description cannot dilute
+    a title that is nearly the same as an existing one.
+    """
+
+    def __init__(self, path: Path, num_perm: int = 96, bands: int = 32):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(_MINHASH_SEED)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+        self.entries: dict[str, dict] = {}
+        self._buckets: dict[tuple, set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _minhash(self, shingles: set[str]) -> list[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+                  for s in shingles]
+        if not hashes:
+            return [_MERSENNE_PRIME] * self.num_perm
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def signature(self, idea: dict) -> list[int]:
+        """MinHash of an idea's shingles followed by the MinHash of its title shingles."""
+        return self._minhash(_shingles(idea)) + self._minhash(_title_shingles(idea))
+
+    def _band_keys(self, signature: list[int]) -> list[tuple]:
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                for band in range(2 * self.bands)]
+
+    def _score(self, signature: list[int], other: list[int]) -> float:
+        """Estimated Jaccard similarity, the higher of the full and title-only estimates."""
+        n = self.num_perm
+        full = sum(x == y for x, y in zip(signature[:n], other[:n]))
+        title = sum(x == y for x, y in zip(signature[n:], other[n:]))
+        if signature[n] == _MERSENNE_PRIME or other[n] == _MERSENNE_PRIME:
+            title = 0  # a title without shingles matches nothing
+        return max(full, title) / n
+
+    def _insert(self, slug: str, title: str, signature: list[int]) -> None:
+        self.entries[slug] = {"title": title, "signature": signature}
+        for key in self._band_keys(signature):
+            self._buckets[key].add(slug)
+
+    def add(self, slug: str, idea: dict, persist: bool = True) -> None:
+        """Index an app and, unless ``persist`` is False, append it to the index file."""
+        signature = self.signature(idea)
+        self._insert(slug, idea.get("title", ""), signature)
+        if not persist:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"slug": slug, "title": idea.get("title", ""),
+                                "signature": signature}) + "\n")
+
+    def similar(self, idea: dict, threshold: float) -> list[tuple[str, str, float]]:
+        """Return (slug, title, estimated_jaccard) for indexed apps at or above ``threshold``."""
+        signature = self.signature(idea)
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates |= self._buckets.get(key, set())
+        matches = []
+        for slug in candidates:
+            score = self._score(signature, self.entries[slug]["signature"])
+            if score >= threshold:
+                matches.append((slug, self.entries[slug]["title"], round(score, 2)))
+        return sorted(matches, key=lambda m: -m[2])
+
+    @classmethod
+    def load(cls, path: Path, num_perm: int = 96, bands: int = 32) -> "MinHashIndex":
+        """Load the index from ``path``; returns an empty index if it does not exist."""
+        index = cls(path, num_perm, bands)
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if len(entry.get("signature", ())) == 2 * num_perm:
+                        index._insert(entry["slug"], entry["title"], entry["signature"])
+        return index
+
+    def rebuild(self, apps: dict[str, dict]) -> None:
+        """Replace the index contents with ``apps`` (slug -> idea) and rewrite the file."""
+        self.entries.clear()
+        self._buckets.clear()
+        lines = []
+        for slug, idea in apps.items():
+            signature = self.signature(idea)
+            self._insert(slug, idea.get("title", ""), signature)
+            lines.append(json.dumps({"slug": slug, "title": idea.get("title", ""),
+                                     "signature": signature}))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text("".join(line + "\n" for line in lines))
+        tmp.replace(self.path)
+        logger.info("Rebuilt near-duplicate index with %d apps", len(self.entries))
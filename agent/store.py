@@ -0,0 +1,243 @@
+"""SQLite store of app metadata and benchmark rows.
+
+``apps.db`` in the repo root is a cache of the per-app metadata.json files,
+which stay the source of truth. sync() imports apps whose metadata.json is
+new or changed since it was recorded, using one stat per app directory, so
+the gallery and the dedup checks query indexed tables instead of opening
+and parsing every metadata file.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "apps.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    slug TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS apps_date ON apps (date DESC, slug);
+CREATE INDEX IF NOT EXISTS apps_category ON apps (category);
+CREATE INDEX IF NOT EXISTS apps_model ON apps (model);
+
+CREATE TABLE IF NOT EXISTS benchmarks (
+    slug TEXT PRIMARY KEY REFERENCES apps (slug) ON DELETE CASCADE,
+    date TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL DEFAULT '',
+    attempt INTEGER,
+    phase1_seconds REAL,
+    phase2_seconds REAL,
+    total_seconds REAL,
+    output_bytes INTEGER,
+    eval_tokens_per_second REAL
+);
+CREATE INDEX IF NOT EXISTS benchmarks_date ON benchmarks (date);
+CREATE INDEX IF NOT EXISTS benchmarks_model ON benchmarks (model);
+
+CREATE TABLE IF NOT EXISTS fragments (
+    slug TEXT PRIMARY KEY REFERENCES apps (slug) ON DELETE CASCADE,
+    template_sha TEXT NOT NULL,
+    card TEXT NOT NULL,
+    row TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    name TEXT PRIMARY KEY,
+    sha TEXT NOT NULL
+);
+"""
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _metadata_mtimes(repo: Path) -> dict[str, int]:
+    """Map each app directory to the mtime of its metadata.json."""
+    mtimes = {}
+    with os.scandir(repo) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                mtimes[entry.name] = os.stat(Path(entry.path) / "metadata.json").st_mtime_ns
+            except OSError:
+                continue
+    return mtimes
+
+
+class AppStore:
+    """Connection to a repo's app store; use open_store() to get a synced one."""
+
+    def __init__(self, repo_path: str):
+        self.repo = Path(repo_path)
+        self.repo.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.repo / STORE_FILE)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "AppStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _upsert(self, slug: str, metadata: dict, mtime_ns: int) -> None:
+        benchmark = metadata.get("benchmark")
+        benchmark = benchmark if isinstance(benchmark, dict) else None
+        model = str((benchmark or {}).get("model") or "")
+        date = str(metadata.get("date") or "")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO apps "
+            "(slug, title, description, category, date, model, mtime_ns, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (slug, str(metadata.get("title") or ""), str(metadata.get("description") or ""),
+             str(metadata.get("category") or ""), date, model, mtime_ns,
+             json.dumps(metadata)),
+        )
+        if benchmark is None:
+            return
+        phase2 = benchmark.get("phase2") if isinstance(benchmark.get("phase2"), dict) else {}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO benchmarks (slug, date, model, attempt, phase1_seconds, "
+            "phase2_seconds, total_seconds, output_bytes, eval_tokens_per_second) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (slug, date, model, _number(benchmark.get("attempt")),
+             _number(benchmark.get("phase1_seconds")), _number(benchmark.get("phase2_seconds")),
+             _number(benchmark.get("total_seconds")), _number(benchmark.get("output_bytes")),
+             _number(phase2.get("eval_tokens_per_second"))),
+        )
+
+    def record(self, slug: str, metadata: dict) -> None:
+        """Store a freshly written app; its metadata.json must already exist."""
+        mtime = os.stat(self.repo / slug / "metadata.json").st_mtime_ns
+        with self.conn:
+            self._upsert(slug, metadata, mtime)
+
+    def sync(self) -> int:
+        """Import new or changed metadata.json files and drop deleted apps.
+
+        Returns the number of rows added, updated or removed.
+        """
+        mtimes = _metadata_mtimes(self.repo)
+        known = dict(self.conn.execute("SELECT slug, mtime_ns FROM apps"))
+        stale = [slug for slug, mtime in mtimes.items() if known.get(slug) != mtime]
+        removed = [slug for slug in known if slug not in mtimes]
+        with self.conn:
+            self.conn.executemany("DELETE FROM apps WHERE slug = ?", [(s,) for s in removed])
+            for slug in stale:
+                metadata_file = self.repo / slug / "metadata.json"
+                try:
+                    with open(metadata_file) as f:
+                        metadata = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.warning("Failed to read %s: %s", metadata_file, e)
+                    continue
+                if isinstance(metadata, dict):
+                    self._upsert(slug, metadata, mtimes[slug])
+        if stale or removed:
+            logger.info("Synced app store: %d imported, %d removed", len(stale), len(removed))
+        return len(stale) + len(removed)
+
+    def dedup_apps(self) -> list[dict]:
+        """Slug, title, description, category and date of every app, newest first.
+
+        Reads indexed columns only, without parsing metadata.
+        """
+        rows = self.conn.execute("SELECT slug, title, description, category, date FROM apps "
+                                 "ORDER BY date DESC, slug")
+        return [dict(row) for row in rows]
+
+    def categories(self) -> list[str]:
+        """Distinct app categories, sorted."""
+        rows = self.conn.execute("SELECT DISTINCT category FROM apps")
+        return sorted({row[0] or "other" for row in rows})
+
+    def benchmark_summary(self) -> dict:
+        """Aggregate benchmark figures for the benchmark page."""
+        row = self.conn.execute(
+            "SELECT COUNT(*) AS apps, AVG(total_seconds) AS avg_total_seconds, "
+            "COALESCE(SUM(output_bytes), 0) AS output_bytes, "
+            "AVG(eval_tokens_per_second) AS avg_eval_tokens_per_second FROM benchmarks"
+        ).fetchone()
+        summary = dict(row)
+        latest = self.conn.execute(
+            "SELECT model FROM benchmarks WHERE model != '' ORDER BY date DESC LIMIT 1"
+        ).fetchone()
+        summary["model"] = latest[0] if latest else None
+        summary["models"] = [dict(r) for r in self.conn.execute(
+            "SELECT model, COUNT(*) AS apps, AVG(total_seconds) AS avg_total_seconds "
+            "FROM benchmarks GROUP BY model ORDER BY apps DESC"
+        )]
+        return summary
+
+    def stale_fragments(self, template_sha: str,
+                        slugs: list[str] | None = None) -> list[dict]:
+        """Metadata of apps whose rendered fragments are missing or out of date.
+
+        Fragments rendered with other templates are stale, as are those of
+        ``slugs``, which are re-rendered regardless.
+        """
+        rows = self.conn.execute(
+            "SELECT a.slug, a.metadata FROM apps a LEFT JOIN fragments f USING (slug) "
+            "WHERE f.slug IS NULL OR f.template_sha != ?", (template_sha,)
+        ).fetchall()
+        stale = {row["slug"]: row["metadata"] for row in rows}
+        for slug in slugs or ():
+            if slug not in stale:
+                row = self.conn.execute("SELECT metadata FROM apps WHERE slug = ?",
+                                        (slug,)).fetchone()
+                if row:
+                    stale[slug] = row["metadata"]
+        return [{**json.loads(metadata), "dir_name": slug} for slug, metadata in stale.items()]
+
+    def save_fragments(self, template_sha: str, fragments: list[tuple[str, str, str]]) -> None:
+        """Store rendered (slug, card, row) fragments."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fragments (slug, template_sha, card, row) "
+                "VALUES (?, ?, ?, ?)",
+                [(slug, template_sha, card, row) for slug, card, row in fragments],
+            )
+
+    def fragments(self) -> tuple[list[str], list[str]]:
+        """Rendered gallery cards and benchmark rows, newest app first."""
+        rows = self.conn.execute(
+            "SELECT f.card, f.row FROM apps a JOIN fragments f USING (slug) "
+            "ORDER BY a.date DESC, a.slug"
+        ).fetchall()
+        return [r["card"] for r in rows], [r["row"] for r in rows if r["row"]]
+
+    def page_hash(self, name: str) -> str | None:
+        row = self.conn.execute("SELECT sha FROM pages WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_page_hash(self, name: str, sha: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pages (name, sha) VALUES (?, ?)",
+                              (name, sha))
+
+
+def open_store(repo_path: str) -> AppStore:
+    """Open the repo's app store and bring it up to date with the app directories."""
+    store = AppStore(repo_path)
+    store.sync()
+    return store
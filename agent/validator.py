@@ -1,7 +1,23 @@
-"""Validates generated HTML for structural correctness."""
+"""Validates generated HTML for structural correctness.
 
+The document is tokenized once by HtmlValidator; each check is a Rule that
+subscribes to tokenizer events (declarations, start/end tags, text) and
+reports its errors when the document is finished. The validator can be fed
+a complete document or streamed chunks.
+"""
+
+import hashlib
 import logging
 import re
+import threading
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+try:
+    import esprima
+except ImportError:  # pragma: no cover - optional dependency
+    esprima = None
 
 logger = logging.getLogger(__name__)
 
@@ -9,59 +25,420 @@ REQUIRED_ELEMENTS = ["<!doctype html>", "<html", "<head", "<title", "<body"]
 MAX_FILE_SIZE = 500_000  # 500KB
 MIN_FILE_SIZE = 200  # bytes
 
-# External domains that indicate network dependencies
-EXTERNAL_PATTERNS = [
-    r'src=["\']https?://',
-    r'href=["\']https?://[^"\']*\.css',
-    r'@import\s+url\(["\']?https?://',
-]
+# Elements that never have an end tag
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr",
+}
+# Elements whose end tag HTML allows to be omitted
+OPTIONAL_END_ELEMENTS = {
+    "html", "head", "body", "p", "li", "dt", "dd", "option", "optgroup", "tr",
+    "td", "th", "thead", "tbody", "tfoot", "colgroup", "caption", "rb", "rt",
+    "rtc", "rp",
+}
+_REMOTE_URL = re.compile(r"^\s*(?:https?:)?//", re.IGNORECASE)
+_REMOTE_IMPORT = re.compile(r'@import\s+(?:url\()?["\']?(?:https?:)?//', re.IGNORECASE)
 
+# <script type> values that hold JavaScript (module scripts are parsed as modules)
+JS_SCRIPT_TYPES = {"", "text/javascript", "application/javascript", "text/ecmascript", "module"}
+# Syntax newer than esprima (ES2017) understands; a parse error on a line
+# using it is inconclusive. Lines are matched with string literals blanked.
+_NEWER_JS_SYNTAX = re.compile(
+    r"\?\.(?!\d)|\?\?|\|\|=|&&=|\bcatch\s*\{|\b\d[\d_]*n\b|\d_\d"
+    r"|\bfor\s+await\b|\basync\s+(?:function\s*)?\*|\(\?<[A-Za-z_$]|\\[kpP][<{]"
+    r"|\.#[A-Za-z_$]|^\s*(?:static\s+)?#[A-Za-z_$]"
+)
+# A class field declaration; only inconclusive when esprima stops at its = or ;
+_CLASS_FIELD = re.compile(r"^\s*(?:static\s+)?[A-Za-z_$][\w$]*\s*(=(?!=)|;)")
+_JS_STRING = re.compile(r"""'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|`(?:[^`\\]|\\.)*`""")
+# Characters of a <script>/<style> body buffered before the tokenizer runs.
+# HTMLParser rescans an open raw-text body from its start on every feed, so
+# token-sized chunks would make streaming validation quadratic in its length.
+FEED_BATCH = 8192
+_JS_CACHE_SIZE = 256
+_js_cache: OrderedDict[str, str | None] = OrderedDict()
+_js_cache_lock = threading.Lock()
 
-def validate_html(html: str) -> tuple[bool, list[str]]:
-    """Validate generated HTML. Returns (is_valid, list_of_errors)."""
-    errors = []
-    html_lower = html.lower()
-
-    # Size checks
-    size = len(html.encode("utf-8"))
-    if size < MIN_FILE_SIZE:
-        errors.append(f"File too small ({size} bytes, min {MIN_FILE_SIZE})")
-    if size > MAX_FILE_SIZE:
-        errors.append(f"File too large ({size} bytes, max {MAX_FILE_SIZE})")
-
-    # Required elements
-    for element in REQUIRED_ELEMENTS:
-        if element not in html_lower:
-            errors.append(f"Missing required element: {element}")
-
-    # Check for closing tags
-    for tag in ["</html>", "</head>", "</body>"]:
-        if tag not in html_lower:
-            errors.append(f"Missing closing tag: {tag}")
-
-    # Check title is not empty
-    title_match = re.search(r"<title>(.*?)</title>", html, re.IGNORECASE | re.DOTALL)
-    if title_match:
-        if not title_match.group(1).strip():
-            errors.append("Empty <title> element")
-    else:
-        errors.append("No <title> element found")
 
-    # Check for external dependencies (warn but don't fail)
-    for pattern in EXTERNAL_PATTERNS:
-        if re.search(pattern, html, re.IGNORECASE):
-            logger.warning("External dependency detected: %s", pattern)
+def _is_newer_syntax(source: str, line: str, column: int) -> bool:
+    """True if a parse error at ``column`` of ``line`` may be newer syntax."""
+    code = _JS_STRING.sub('""', line)
+    if _NEWER_JS_SYNTAX.search(code):
+        return True
+    field = _CLASS_FIELD.match(line)
+    return bool(field and field.start(1) == column - 1 and re.search(r"\bclass\b", source))
+
+
+def _parse_js(source: str, module: bool) -> str | None:
+    try:
+        if module:
+            esprima.parseModule(source)
+        else:
+            esprima.parseScript(source)
+    except esprima.Error as e:
+        line_number = getattr(e, "lineNumber", 0) or 0
+        lines = source.splitlines()
+        line = lines[line_number - 1] if 0 < line_number <= len(lines) else ""
+        if _is_newer_syntax(source, line, getattr(e, "column", 0) or 0):
+            logger.debug("Skipping JS syntax error on newer syntax: %s (%s)", e, line.strip())
+            return None
+        return str(e)
+    except Exception as e:
+        # esprima has internal assertions (e.g. on `${}`) and recursion
+        # limits; a script it cannot handle is treated as not parseable
+        logger.debug("esprima could not parse script: %r", e)
+        return None
+    return None
+
+
+def js_syntax_error(source: str, module: bool = False) -> str | None:
+    """Return esprima's syntax error for ``source``, or None if it parses.
+
+    Results are cached by content hash, so re-validating a document after a
+    repair only parses the scripts that changed. Returns None when esprima
+    is not installed or the error is on syntax esprima predates.
+    """
+    if esprima is None or not source.strip():
+        return None
+    key = hashlib.sha1(f"{int(module)}{source}".encode("utf-8", "surrogatepass")).hexdigest()
+    with _js_cache_lock:
+        if key in _js_cache:
+            _js_cache.move_to_end(key)
+            return _js_cache[key]
+    error = _parse_js(source, module)
+    with _js_cache_lock:
+        _js_cache[key] = error
+        if len(_js_cache) > _JS_CACHE_SIZE:
+            _js_cache.popitem(last=False)
+    return error
+
+
+class Rule:
+    """A validation check driven by tokenizer events.
+
+    Subclasses override the events they need and return their errors from
+    finish(). ``validator`` gives access to running state such as ``bytes``.
+    """
+
+    name = "rule"
+
+    def start_tag(self, validator: "HtmlValidator", tag: str, attrs: list) -> None:
+        pass
+
+    def end_tag(self, validator: "HtmlValidator", tag: str) -> None:
+        pass
+
+    def data(self, validator: "HtmlValidator", text: str) -> None:
+        pass
+
+    def decl(self, validator: "HtmlValidator", decl: str) -> None:
+        pass
+
+    def finish(self, validator: "HtmlValidator") -> list[str]:
+        return []
+
+
+class RemoteScriptRule(Rule):
+    """Reject scripts loaded from another host, failing as soon as one is seen."""
+
+    name = "remote_script"
+
+    def __init__(self):
+        self.errors: list[str] = []
+
+    def start_tag(self, validator, tag, attrs):
+        src = dict(attrs).get("src") or ""
+        if tag == "script" and _REMOTE_URL.match(src):
+            self.errors.append(f"External script: {src}")
+            validator.fail(self.errors[-1])
+
+    def finish(self, validator):
+        return self.errors
+
+
+class SizeRule(Rule):
+    name = "size"
+
+    def finish(self, validator):
+        size = validator.bytes
+        if size < MIN_FILE_SIZE:
+            return [f"File too small ({size} bytes, min {MIN_FILE_SIZE})"]
+        if size > MAX_FILE_SIZE:
+            return [f"File too large ({size} bytes, max {MAX_FILE_SIZE})"]
+        return []
+
+
+class RequiredElementsRule(Rule):
+    """Doctype, the html/head/title/body elements and their closing tags."""
+
+    name = "required"
+
+    def __init__(self):
+        self.seen: set[str] = set()
+
+    def decl(self, validator, decl):
+        if decl.lower().split() == ["doctype", "html"]:
+            self.seen.add("<!doctype html>")
+
+    def start_tag(self, validator, tag, attrs):
+        self.seen.add(f"<{tag}")
+
+    def end_tag(self, validator, tag):
+        self.seen.add(f"</{tag}>")
+
+    def finish(self, validator):
+        errors = [f"Missing required element: {e}" for e in REQUIRED_ELEMENTS
+                  if e not in self.seen]
+        errors += [f"Missing closing tag: {t}" for t in ("</html>", "</head>", "</body>")
+                   if t not in self.seen]
+        return errors
+
+
+class TitleRule(Rule):
+    name = "title"
+
+    def __init__(self):
+        self.inside = False
+        self.closed = False
+        self.text: list[str] = []
+
+    def start_tag(self, validator, tag, attrs):
+        if tag == "title" and not self.closed:
+            self.inside = True
+
+    def end_tag(self, validator, tag):
+        if tag == "title" and self.inside:
+            self.inside = False
+            self.closed = True
+
+    def data(self, validator, text):
+        if self.inside:
+            self.text.append(text)
+
+    def finish(self, validator):
+        if not self.closed:
+            return ["No <title> element found"]
+        if not "".join(self.text).strip():
+            return ["Empty <title> element"]
+        return []
+
+
+class TagBalanceRule(Rule):
+    """Every element that requires an end tag is closed as often as it is opened."""
+
+    name = "balance"
 
-    # Basic well-formedness: script and style tags should be closed
-    for tag in ["script", "style"]:
-        open_count = len(re.findall(rf"<{tag}[\s>]", html_lower))
-        close_count = len(re.findall(rf"</{tag}>", html_lower))
-        if open_count != close_count:
-            errors.append(f"Mismatched <{tag}> tags: {open_count} opened, {close_count} closed")
+    def __init__(self):
+        self.opened: dict[str, int] = {}
+        self.closed: dict[str, int] = {}
+
+    def start_tag(self, validator, tag, attrs):
+        if tag not in VOID_ELEMENTS and tag not in OPTIONAL_END_ELEMENTS:
+            self.opened[tag] = self.opened.get(tag, 0) + 1
+
+    def end_tag(self, validator, tag):
+        if tag not in VOID_ELEMENTS and tag not in OPTIONAL_END_ELEMENTS:
+            self.closed[tag] = self.closed.get(tag, 0) + 1
+
+    def finish(self, validator):
+        errors = []
+        for tag in sorted(self.opened.keys() | self.closed.keys()):
+            opened, closed = self.opened.get(tag, 0), self.closed.get(tag, 0)
+            if opened != closed:
+                errors.append(f"Mismatched <{tag}> tags: {opened} opened, {closed} closed")
+        return errors
+
+
+class ExternalResourceRule(Rule):
+    """Log remote resources other than scripts (stylesheets, imports, media).
+
+    Remote scripts are rejected by RemoteScriptRule.
+    """
+
+    name = "external"
+
+    def __init__(self):
+        self.in_style = False
+        self.found: list[str] = []
+
+    def start_tag(self, validator, tag, attrs):
+        self.in_style = tag == "style"
+        attrs = dict(attrs)
+        src = attrs.get("src") or ""
+        href = attrs.get("href") or ""
+        if src and tag != "script" and _REMOTE_URL.match(src):
+            self.found.append(f"<{tag} src={src}>")
+        elif tag == "link" and _REMOTE_URL.match(href) and ".css" in href.lower():
+            self.found.append(f"<link href={href}>")
+
+    def end_tag(self, validator, tag):
+        if tag == "style":
+            self.in_style = False
+
+    def data(self, validator, text):
+        if self.in_style and _REMOTE_IMPORT.search(text):
+            self.found.append("@import of a remote stylesheet")
+
+    def finish(self, validator):
+        for resource in self.found:
+            logger.warning("External dependency detected: %s", resource)
+        return []
+
+
+class JsSyntaxRule(Rule):
+    """Parse every inline script; skipped when esprima is not installed."""
+
+    name = "js_syntax"
+
+    def __init__(self):
+        self.scripts: list[tuple[str, bool]] = []
+        self._parts: list[str] | None = None
+        self._module = False
+
+    def start_tag(self, validator, tag, attrs):
+        if tag != "script":
+            return
+        attrs = dict(attrs)
+        script_type = (attrs.get("type") or "").strip().lower()
+        if attrs.get("src") is None and script_type in JS_SCRIPT_TYPES:
+            self._parts = []
+            self._module = script_type == "module"
+
+    def data(self, validator, text):
+        if self._parts is not None:
+            self._parts.append(text)
+
+    def end_tag(self, validator, tag):
+        if tag == "script" and self._parts is not None:
+            self.scripts.append(("".join(self._parts), self._module))
+            self._parts = None
+
+    def finish(self, validator):
+        errors = []
+        for number, (source, module) in enumerate(self.scripts, 1):
+            error = js_syntax_error(source, module)
+            if error:
+                errors.append(f"JavaScript syntax error in inline script {number}: {error}")
+        return errors
+
+
+def default_rules() -> list[Rule]:
+    """Fresh instances of the rules validate_html() applies."""
+    return [SizeRule(), RequiredElementsRule(), TitleRule(), TagBalanceRule(),
+            RemoteScriptRule(), ExternalResourceRule(), JsSyntaxRule()]
+
+
+class HtmlValidator(HTMLParser):
+    """One tokenizer pass that dispatches events to every subscribed rule.
+
+    Call feed() with the whole document or with chunks as they arrive, then
+    close() for the result. Inside <script> and <style>, small chunks are
+    tokenized in batches of FEED_BATCH characters or once the closing tag
+    arrives. ``bytes`` is the UTF-8 size fed so far and
+    ``rule_seconds`` the time spent in each rule. Rules may call fail()
+    to flag a document that cannot pass, which ``fatal`` then holds.
+    """
+
+    def __init__(self, rules: list[Rule] | None = None):
+        super().__init__(convert_charrefs=True)
+        self.rules = default_rules() if rules is None else rules
+        self.bytes = 0
+        self.fatal: str | None = None
+        self.rule_seconds = {rule.name: 0.0 for rule in self.rules}
+        self._pending = ""
+        # Only dispatch to rules that override an event
+        self._subscribers = {
+            event: [r for r in self.rules if getattr(type(r), event) is not getattr(Rule, event)]
+            for event in ("start_tag", "end_tag", "data", "decl")
+        }
+
+    def _dispatch(self, event: str, *args) -> None:
+        for rule in self._subscribers[event]:
+            t0 = time.perf_counter()
+            getattr(rule, event)(self, *args)
+            self.rule_seconds[rule.name] += time.perf_counter() - t0
+
+    def fail(self, message: str) -> None:
+        """Record a problem that makes the document unusable (the first one wins)."""
+        if self.fatal is None:
+            self.fatal = message
+
+    def feed(self, data: str) -> None:
+        self.bytes += len(data) if data.isascii() else len(data.encode("utf-8"))
+        self._pending += data
+        raw_text = self.cdata_elem
+        if (raw_text is None or len(self._pending) >= FEED_BATCH
+                or f"</{raw_text}" in self._pending[-len(data) - len(raw_text) - 2:].lower()):
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            data, self._pending = self._pending, ""
+            super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._dispatch("start_tag", tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        # <path/> and friends open and close in one token
+        self._dispatch("start_tag", tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self._dispatch("end_tag", tag)
+
+    def handle_endtag(self, tag):
+        self._dispatch("end_tag", tag)
+
+    def handle_data(self, data):
+        self._dispatch("data", data)
+
+    def handle_decl(self, decl):
+        self._dispatch("decl", decl)
+
+    def close(self) -> tuple[bool, list[str]]:
+        """Finish the document and return (is_valid, errors)."""
+        self._flush()
+        super().close()
+        errors = []
+        for rule in self.rules:
+            t0 = time.perf_counter()
+            errors.extend(rule.finish(self))
+            self.rule_seconds[rule.name] += time.perf_counter() - t0
+        return not errors, errors
+
+
+class StreamGuard:
+    """Fail-fast checks for a document that is still being generated.
+
+    Feed it the document as it streams in; feed() returns the reason the
+    document can no longer pass, or None.
+    """
+
+    def __init__(self):
+        self.validator = HtmlValidator(rules=[RemoteScriptRule()])
+
+    @property
+    def bytes(self) -> int:
+        return self.validator.bytes
+
+    def feed(self, chunk: str) -> str | None:
+        if self.validator.fatal is None:
+            self.validator.feed(chunk)
+            if self.validator.bytes > MAX_FILE_SIZE:
+                self.validator.fail(f"File too large (over {MAX_FILE_SIZE} bytes while streaming)")
+        return self.validator.fatal
+
+
+def validate_html(html: str) -> tuple[bool, list[str]]:
+    """Validate generated HTML. Returns (is_valid, list_of_errors)."""
+    validator = HtmlValidator()
+    validator.feed(html)
+    is_valid, errors = validator.close()
+    logger.debug("Validator rule timings: %s",
+                 {name: round(s, 4) for name, s in validator.rule_seconds.items()})
 
     if errors:
         logger.warning("Validation failed: %s", "; ".join(errors))
     else:
-        logger.info("Validation passed (size: %d bytes)", size)
+        logger.info("Validation passed (size: %d bytes)", validator.bytes)
 
-    return len(errors) == 0, errors
+    return is_valid, errors